@@ -0,0 +1,201 @@
+# bench.py — load test untuk handler bot dengan user simulasi.
+# Menjalankan handler langsung dengan FakeBot (tanpa jaringan) dan Mongo in-memory,
+# lalu menulis hasil sebagai JSON supaya bisa dibandingkan sebelum/sesudah perubahan.
+#
+#   python bench.py --users 200 --messages 20 --output bench_output.txt
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+os.environ["MONGO_URI"] = "memory://"
+os.environ.setdefault("OWNER_ID", "1")
+
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+import support  # noqa: E402
+import storage  # noqa: E402
+from fake_telegram import FakeBot, make_message_update, make_callback_update  # noqa: E402
+
+ANON_COMMANDS = {"/start": bot.start, "/settings": bot.settings}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.match_waits = []
+        self.errors = 0
+
+    def record(self, name, seconds):
+        self.latencies.setdefault(name, []).append(seconds)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3) if values else 0.0,
+    }
+
+
+# --- DISPATCH ---
+# Meniru routing handler di start_anon_bot / start_support_bot
+async def dispatch_anon(recorder, fake_bot, payload):
+    update = Update.de_json(payload, fake_bot)
+    context = SimpleNamespace(bot=fake_bot)
+    if update.callback_query:
+        name, handler = "callback_handler", bot.callback_handler
+    else:
+        command = (update.message.text or "").split(" ")[0]
+        handler = ANON_COMMANDS.get(command, bot.message_handler)
+        name = handler.__name__
+    started = time.perf_counter()
+    try:
+        await handler(update, context)
+    except Exception:
+        recorder.errors += 1
+    recorder.record(name, time.perf_counter() - started)
+
+
+async def dispatch_support(recorder, fake_bot, payload):
+    update = Update.de_json(payload, fake_bot)
+    context = SimpleNamespace(bot=fake_bot)
+    started = time.perf_counter()
+    try:
+        await support.handle_message(update, context)
+    except Exception:
+        recorder.errors += 1
+    recorder.record("support.handle_message", time.perf_counter() - started)
+
+
+# --- SIMULATED USERS ---
+async def anon_user(user_id, args, recorder, fake_bot, rng):
+    send = lambda payload: dispatch_anon(recorder, fake_bot, payload)  # noqa: E731
+    gender = rng.choice(["laki-laki", "perempuan"])
+    await send(make_message_update(user_id, "/start"))
+    await send(make_message_update(user_id, rng.choice(["id", "en"])))
+    await send(make_message_update(user_id, gender))
+    if rng.random() < args.settings_ratio:
+        await send(make_message_update(user_id, "/settings"))
+        await send(make_callback_update(user_id, rng.choice(["toggle_photo", "toggle_video", "enable_all"])))
+
+    for _ in range(args.rounds):
+        started = time.monotonic()
+        if rng.random() < args.gender_ratio:
+            await send(make_message_update(user_id, "👥 Search by Gender"))
+            await send(make_message_update(user_id, rng.choice(["Laki-laki", "Perempuan"])))
+        else:
+            await send(make_message_update(user_id, "🔍 Find a Partner"))
+
+        while user_id not in bot.routes and time.monotonic() - started < args.match_timeout:
+            await asyncio.sleep(0.005)
+        if user_id not in bot.routes:
+            await send(make_message_update(user_id, "/cancel"))
+            continue
+        recorder.match_waits.append(time.monotonic() - started)
+
+        for n in range(args.messages):
+            if user_id not in bot.routes:
+                break
+            if rng.random() < args.photo_ratio:
+                photo = [{"file_id": f"p{user_id}-{n}", "file_unique_id": f"u{user_id}-{n}", "width": 1, "height": 1}]
+                await send(make_message_update(user_id, photo=photo))
+            else:
+                await send(make_message_update(user_id, f"halo {n}"))
+            await asyncio.sleep(0)
+
+        roll = rng.random()
+        if roll < args.report_ratio:
+            await send(make_message_update(user_id, "/report"))
+        elif roll < args.report_ratio + args.next_ratio:
+            await send(make_message_update(user_id, "/next"))
+            await send(make_message_update(user_id, "/stop"))
+        else:
+            await send(make_message_update(user_id, "/stop"))
+
+
+async def support_user(user_id, args, recorder, fake_bot):
+    for n in range(args.support_messages):
+        await dispatch_support(recorder, fake_bot, make_message_update(user_id, f"tolong {n}"))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    anon_bot = FakeBot(latency=args.bot_latency, username="anon_bot")
+    support_bot = FakeBot(latency=args.bot_latency, username="support_bot")
+    ops_before = sum(storage.op_counts.values())
+
+    started = time.perf_counter()
+    tasks = [anon_user(1000 + i, args, recorder, anon_bot, random.Random(rng.random())) for i in range(args.users)]
+    tasks += [support_user(500000 + i, args, recorder, support_bot) for i in range(args.support_users)]
+    await asyncio.gather(*tasks)
+    await support.message_writer.stop()
+    await support.reply_writer.stop()
+    await support.user_counters.stop()
+    await support.daily_counters.stop()
+    elapsed = time.perf_counter() - started
+
+    updates = sum(len(values) for values in recorder.latencies.values())
+    db_ops = sum(storage.op_counts.values()) - ops_before
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    return {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "updates": updates,
+        "throughput_ups": round(updates / elapsed, 1) if elapsed else 0.0,
+        "errors": recorder.errors,
+        "latency": summarize(all_latencies),
+        "handlers": {name: summarize(values) for name, values in sorted(recorder.latencies.items())},
+        "match_wait": summarize(recorder.match_waits),
+        "matches": len(recorder.match_waits),
+        "db_ops": db_ops,
+        "db_ops_per_update": round(db_ops / updates, 3) if updates else 0.0,
+        "db_ops_by_type": dict(storage.op_counts),
+        "telegram_calls": len(anon_bot.calls) + len(support_bot.calls),
+        "user_cache": bot.user_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark handler anon/support bot dengan user simulasi")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3, help="siklus cari partner per user")
+    parser.add_argument("--messages", type=int, default=20, help="pesan per chat")
+    parser.add_argument("--support-users", type=int, default=50)
+    parser.add_argument("--support-messages", type=int, default=5)
+    parser.add_argument("--gender-ratio", type=float, default=0.3)
+    parser.add_argument("--photo-ratio", type=float, default=0.1)
+    parser.add_argument("--settings-ratio", type=float, default=0.2)
+    parser.add_argument("--next-ratio", type=float, default=0.3)
+    parser.add_argument("--report-ratio", type=float, default=0.05)
+    parser.add_argument("--match-timeout", type=float, default=2.0)
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="latensi simulasi per panggilan Bot API (detik)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="tulis JSON ke file ini (default stdout)")
+    args = parser.parse_args()
+
+    result = json.dumps(asyncio.run(run(args)), indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,76 @@
 import os
+import time
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+import functools
+from collections import namedtuple
+from datetime import datetime, timedelta
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
-from pymongo import MongoClient
+from pymongo import ReturnDocument
 from dotenv import load_dotenv
+import metrics
+import profiler
+import render
+from render import MEDIA_FIELDS, MEDIA_BITS, MUTED, GENDER_MARKUP, REPLY_MARKUP, media_mask, settings_markup
+from cache import LRUCache
+from matching import MatchEngine, BlockIndex, SharedMatchEngine
+from ratelimit import SendScheduler, PRIORITY_HIGH
+from dispatch import KeyedUpdateProcessor
+from storage import get_database
+from timers import TimingWheel
 
 load_dotenv()
 
 # --- Init ---
 TOKEN = os.getenv("BOT_TOKEN")
 MONGO_URI = os.getenv("MONGO_URI")
-
-client = MongoClient(MONGO_URI)
-db = client["anon_chat"]
+OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))
+SEARCH_TIMEOUT = int(os.getenv("SEARCH_TIMEOUT", "600"))          # detik mencari sebelum dikeluarkan dari antrian
+CHAT_IDLE_TIMEOUT = int(os.getenv("CHAT_IDLE_TIMEOUT", "1800"))   # detik tanpa pesan sebelum pasangan diakhiri
+# local: antrian dan route di memori proses ini; shared: antrian di Mongo dengan klaim atomik,
+# untuk beberapa worker sekaligus (cache user dan route lokal dimatikan karena bisa basi)
+MATCH_BACKEND = os.getenv("MATCH_BACKEND", "local")
+SHARED_MATCHING = MATCH_BACKEND == "shared"
+
+db = get_database(MONGO_URI, "anon_chat")
 users = db["users"]
-queue = []
+blocks = db["blocks"]
+meta = db["meta"]  # penanda migrasi satu kali
+block_index = BlockIndex()
+queue = MatchEngine(block_index)
+shared_queue = SharedMatchEngine(users, blocks, block_index)
+routes = {}  # user_id: Route ke partner yang sedang chatting
+user_cache = LRUCache(0 if SHARED_MATCHING else USER_CACHE_SIZE, USER_CACHE_TTL)
+reaper = TimingWheel()  # ("search", user_id) / ("chat", user_a, user_b)
+shared_sizes = {}  # mode shared: ukuran antrian terakhir dari Mongo, diperbarui berkala untuk gauge
+shared_pairs = 0   # mode shared: jumlah pasangan chatting terakhir dari Mongo
+queue_sizer = {}   # "task" dan "stopping" untuk loop pembaruan shared_sizes/shared_pairs
+QUEUE_SIZE_INTERVAL = 30  # detik
 
 logging.basicConfig(level=logging.INFO)
 
-GENDER_KEYBOARD = [["Laki-laki", "Perempuan"]]
-REPLY_KEYBOARD = [["🔍 Find a Partner", "👥 Search by Gender"], ["⚙️ Settings"]]
+# --- Metrics ---
+def search_queue_sizes():
+    sizes = {}
+    pools = shared_sizes if SHARED_MATCHING else queue.pool_sizes()
+    for (language, gender, target), size in pools.items():
+        sizes[(language, gender)] = sizes.get((language, gender), 0) + size
+    return sizes
+
+metrics.Gauge("anon_search_queue", "User yang sedang mencari partner", search_queue_sizes, ("language", "gender"))
+metrics.Gauge("anon_active_pairs", "Pasangan yang sedang chatting", lambda: {(): shared_pairs if SHARED_MATCHING else len(routes) // 2})
+metrics.Gauge("anon_session_timers", "Timer expiry yang aktif", lambda: {(kind,): n for kind, n in reaper.counts().items()}, ("kind",))
+SESSIONS_EXPIRED = metrics.Counter("anon_sessions_expired_total", "Pencarian/chat yang diakhiri karena timeout", ("kind",))
+WARM_START_SECONDS = metrics.Histogram("anon_warm_start_seconds", "Durasi rekonstruksi antrian dan pasangan saat start")
+metrics.Gauge("anon_user_cache", "Statistik cache user", lambda: {(key,): value for key, value in user_cache.stats().items()}, ("stat",))
+
+CONTROL_TEXTS = {"🔍 find a partner", "👥 search by gender", "⚙️ settings", "laki-laki", "perempuan"}  # huruf kecil
+TOGGLES = {f"toggle_{field}": field for field in MEDIA_FIELDS}
+MEDIA_ON = {field: True for field in MEDIA_FIELDS}
+MEDIA_OFF = {field: False for field in MEDIA_FIELDS}
 
 # --- TEXTS ---
 TEXTS = {
@@ -90,85 +141,319 @@ TEXTS = {
     "choose_target_gender": {
         "id": "Pilih gender yang ingin dicari:",
         "en": "Choose the gender you want to chat with:"
-    }
+    },
+    "search_timeout": {
+        "id": "⌛ Belum ada partner yang cocok, kamu dikeluarkan dari antrian. Coba cari lagi nanti.",
+        "en": "⌛ No partner found yet, you have been removed from the queue. Please try again later."
+    },
+    "chat_idle": {
+        "id": "💤 Chat diakhiri karena tidak ada aktivitas.",
+        "en": "💤 Chat ended due to inactivity."
+    },
+    "ask_age": {
+        "id": "Masukkan usia kamu (contoh: 20):",
+        "en": "Enter your age (e.g. 20):"
+    },
+    "settings_title": {"id": "⚙️ Pengaturan Media:", "en": "⚙️ Media Settings:"},
+    "settings_gender": {"id": "🧑 Jenis Kelamin", "en": "🧑 Gender"},
+    "settings_age": {"id": "🔞 Usia", "en": "🔞 Age"},
+    "settings_enable_all": {"id": "✅ Aktifkan Semua", "en": "✅ Enable All"},
+    "settings_disable_all": {"id": "❌ Blokir Semua", "en": "❌ Block All"},
+    "settings_language": {"id": "🌐 Bahasa", "en": "🌐 Language"},
+    "media_photo": {"id": "📷 Foto", "en": "📷 Photo"},
+    "media_video": {"id": "🎥 Video", "en": "🎥 Video"},
+    "media_sticker": {"id": "🎭 Stiker", "en": "🎭 Sticker"},
+    "media_voice": {"id": "🎤 Voice", "en": "🎤 Voice"}
 }
 # --- Helper Functions ---
-def t(lang, key):
-    return TEXTS.get(key, {}).get(lang, TEXTS.get(key, {}).get("id", key))
-
-def get_user(user_id):
-    user = users.find_one({"_id": user_id})
-    if not user:
-        user = {"_id": user_id, "gender": None, "language": None, "state": "idle", "partner": None, "blocked": [],
-                "photo": True, "video": True, "sticker": True, "voice": True, "age": None}
-        users.insert_one(user)
+# Teks dan keyboard pengaturan dibangun sekali di sini (lihat render.py)
+render.compile_texts(TEXTS)
+t = render.text
+
+async def get_user(user_id):
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    # Baca dulu; upsert (operasi tulis) hanya untuk user yang belum ada
+    user = await users.find_one({"_id": user_id})
+    if user is None:
+        user = await users.find_one_and_update(
+            {"_id": user_id},
+            {"$setOnInsert": {"gender": None, "language": None, "state": "idle", "partner": None,
+                              "photo": True, "video": True, "sticker": True, "voice": True, "age": None}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+    user_cache.put(user_id, user)
     return user
 
-def update_user(user_id, data):
-    users.update_one({"_id": user_id}, {"$set": data})
-
-def match_partner(user_id):
-    current = get_user(user_id)
-    for partner_id in queue:
-        partner = get_user(partner_id)
-        if partner["state"] == "searching" and partner["language"] == current["language"] and \
-           partner_id != user_id and user_id not in partner.get("blocked", []) and partner_id not in current.get("blocked", []):
-            queue.remove(partner_id)
-            update_user(user_id, {"state": "chatting", "partner": partner_id})
-            update_user(partner_id, {"state": "chatting", "partner": user_id})
-            return partner_id
-    if user_id not in queue:
-        queue.append(user_id)
-    update_user(user_id, {"state": "searching"})
-    return None
+async def update_user(user_id, data):
+    await users.update_one({"_id": user_id}, {"$set": data})
+    cached = user_cache.peek(user_id)
+    if cached is not None:
+        cached.update(data)
+
+# --- Blocks ---
+async def block_user(user_id, target_id):
+    block_index.add(user_id, target_id)
+    await blocks.update_one(
+        {"_id": f"{user_id}:{target_id}"},
+        {"$setOnInsert": {"blocker": user_id, "blocked": target_id, "date": datetime.utcnow()}},
+        upsert=True
+    )
 
-def match_partner_by_gender(user_id, target_gender):
-    current = get_user(user_id)
-    for partner_id in queue:
-        partner = get_user(partner_id)
-        if partner["state"] == "searching" and partner["language"] == current["language"] and \
-           partner["gender"] == target_gender and partner_id != user_id and \
-           user_id not in partner.get("blocked", []) and partner_id not in current.get("blocked", []):
-            queue.remove(partner_id)
-            update_user(user_id, {"state": "chatting", "partner": partner_id})
-            update_user(partner_id, {"state": "chatting", "partner": user_id})
-            return partner_id
-    if user_id not in queue:
-        queue.append(user_id)
-    update_user(user_id, {"state": "searching"})
+async def load_blocks():
+    started = time.perf_counter()
+    await blocks.create_index("blocker")
+    await blocks.create_index("blocked")
+    # Migrasi array `blocked` lama dari dokumen user ke koleksi blocks, sekali saja: scan tanpa
+    # index ini tidak perlu diulang di setiap start setelah penandanya tercatat
+    if await meta.find_one({"_id": "blocks_migrated"}) is None:
+        async for user in users.find({"blocked": {"$exists": True}}, {"blocked": 1}):
+            for target_id in user["blocked"]:
+                await block_user(user["_id"], target_id)
+            await users.update_one({"_id": user["_id"]}, {"$unset": {"blocked": ""}})
+        await meta.update_one({"_id": "blocks_migrated"}, {"$set": {"date": datetime.utcnow()}}, upsert=True)
+    async for block in blocks.find({}, {"blocker": 1, "blocked": 1, "_id": 0}):
+        block_index.add(block["blocker"], block["blocked"])
+    logging.info("Loaded %d block pairs in %.2fs", block_index.pairs, time.perf_counter() - started)
+
+# --- Relay Routing ---
+Route = namedtuple("Route", ["partner", "muted"])  # muted: jenis media yang dimatikan partner
+
+def muted_media(user):
+    return MUTED[media_mask(user)]
+
+def chat_key(user_id, partner_id):
+    return ("chat", user_id, partner_id) if user_id < partner_id else ("chat", partner_id, user_id)
+
+def open_route(user, partner):
+    reaper.schedule(chat_key(user["_id"], partner["_id"]), CHAT_IDLE_TIMEOUT)
+    if SHARED_MATCHING:
+        return
+    routes[user["_id"]] = Route(partner["_id"], muted_media(partner))
+    routes[partner["_id"]] = Route(user["_id"], muted_media(user))
+
+def close_route(user_id):
+    route = routes.pop(user_id, None)
+    if route is not None and getattr(routes.get(route.partner), "partner", None) == user_id:
+        del routes[route.partner]
+
+def is_control(message):
+    text = message.text
+    return text is not None and (text.startswith("/") or text.strip().lower() in CONTROL_TEXTS)
+
+def relay_ready(user_id):
+    # Jalur cepat hanya untuk state "chatting": jawaban prompt (bahasa, umur, gender pencarian)
+    # tidak boleh ikut diteruskan ke partner; tanpa cache state tidak diketahui, pakai jalur lengkap
+    cached = user_cache.peek(user_id)
+    return cached is not None and cached.get("state") == "chatting"
+
+def update_keys(update):
+    # Urutan per user; perintah/tombol dari user yang sedang chatting juga memegang giliran
+    # partner, supaya /stop, /next dan /report tidak balapan dengan update dari sisi lain
+    user = update.effective_user
+    if user is None:
+        return ()
+    route = routes.get(user.id)
+    if route is not None and (update.message is None or is_control(update.message)):
+        return (user.id, route.partner)
+    return (user.id,)
+
+async def relay(message, route, context):
+    if route.muted and any(getattr(message, field) for field in route.muted):
+        return
+    reaper.touch(chat_key(message.chat_id, route.partner), CHAT_IDLE_TIMEOUT)
+    await context.bot.copy_message(route.partner, message.chat_id, message.message_id, rate_limit_args=PRIORITY_HIGH)
+
+async def mark_active(user, partner):
+    # Mode shared: aktivitas chat dicatat di Mongo (paling sering tiap CHAT_IDLE_TIMEOUT/10)
+    # supaya timer idle di worker lain tidak mengakhiri chat yang masih berjalan
+    now = datetime.utcnow()
+    last = user.get("active_at")
+    if last is None or now - last > timedelta(seconds=CHAT_IDLE_TIMEOUT / 10):
+        await users.update_many({"_id": {"$in": [user["_id"], partner["_id"]]}}, {"$set": {"active_at": now}})
+
+async def match_partner(user_id, target_gender=None):
+    current = await get_user(user_id)
+    if SHARED_MATCHING:
+        partner = await shared_queue.match(user_id, current["language"], current["gender"], target_gender)
+        if partner is not None:
+            open_route(current, partner)
+            return partner["_id"]
+        reaper.schedule(("search", user_id), SEARCH_TIMEOUT)
+        return None
+    partner_id = queue.match(user_id, current["language"], current["gender"], target_gender)
+    if partner_id:
+        # Route dibuka dulu supaya update berikutnya dari partner sudah ikut antrian pasangan
+        open_route(current, await get_user(partner_id))
+        await update_user(user_id, {"state": "chatting", "partner": partner_id})
+        await update_user(partner_id, {"state": "chatting", "partner": user_id})
+        return partner_id
+    queue.enqueue(user_id, current["language"], current["gender"], target_gender)
+    reaper.schedule(("search", user_id), SEARCH_TIMEOUT)
+    await update_user(user_id, {"state": "searching", "search_target": target_gender,
+                                "searching_since": datetime.utcnow()})
     return None
 
+async def match_partner_by_gender(user_id, target_gender):
+    return await match_partner(user_id, target_gender)
+
+# --- Warm Start ---
+# Antrian dan pasangan chat disimpan di dokumen user (state/partner/searching_since), jadi
+# setelah restart atau crash keduanya dibangun ulang dari query ber-index pada `state`.
+async def reset_users(user_ids):
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), 1000):
+        await users.update_many({"_id": {"$in": user_ids[i:i + 1000]}}, {"$set": {"state": "idle", "partner": None}})
+
+async def warm_start():
+    started = time.perf_counter()
+    await users.create_index([("state", 1), ("searching_since", 1)])
+
+    stale = []
+    cursor = users.find({"state": "searching"}, {"language": 1, "gender": 1, "search_target": 1})
+    async for user in cursor.sort("searching_since", 1):
+        if user.get("language"):
+            queue.enqueue(user["_id"], user["language"], user.get("gender"), user.get("search_target"))
+            reaper.schedule(("search", user["_id"]), SEARCH_TIMEOUT)
+        else:
+            stale.append(user["_id"])
+
+    chatting = {}
+    async for user in users.find({"state": "chatting"}, {"partner": 1, **{field: 1 for field in MEDIA_FIELDS}}):
+        chatting[user["_id"]] = user
+    for user_id, user in chatting.items():
+        partner = chatting.get(user.get("partner"))
+        if partner is not None and partner.get("partner") == user_id:
+            open_route(user, partner)
+        else:
+            stale.append(user_id)
+
+    await reset_users(stale)
+    elapsed = time.perf_counter() - started
+    WARM_START_SECONDS.observe((), elapsed)
+    logging.info("Warm start: %d searching, %d pairs, %d stale reset in %.2fs",
+                 len(queue), len(routes) // 2, len(stale), elapsed)
+
+async def warm_start_shared():
+    # Antrian bersama sudah ada di Mongo; worker cukup memasang timer expiry. Tidak ada reset
+    # di sini karena worker lain mungkin sedang berada di tengah transisi yang sah.
+    started = time.perf_counter()
+    await users.create_index([("state", 1), ("searching_since", 1)])
+    await shared_queue.ensure_indexes()
+    async for user in users.find({"state": "searching"}, {"_id": 1}):
+        reaper.schedule(("search", user["_id"]), SEARCH_TIMEOUT)
+    async for user in users.find({"state": "chatting"}, {"partner": 1}):
+        if user.get("partner"):
+            reaper.schedule(chat_key(user["_id"], user["partner"]), CHAT_IDLE_TIMEOUT)
+    elapsed = time.perf_counter() - started
+    WARM_START_SECONDS.observe((), elapsed)
+    logging.info("Warm start (shared): %d timers in %.2fs", len(reaper), elapsed)
+
+async def refresh_shared_sizes():
+    global shared_sizes, shared_pairs
+    shared_sizes = await shared_queue.pool_sizes()
+    shared_pairs = await users.count_documents({"state": "chatting"}) // 2
+
+async def run_queue_sizer(stopping):
+    while not stopping.is_set():
+        try:
+            await refresh_shared_sizes()
+        except Exception:
+            logging.exception("Gagal membaca ukuran antrian shared")
+        try:
+            await asyncio.wait_for(stopping.wait(), QUEUE_SIZE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+# --- Session Expiry ---
+# Timer tidak dibatalkan saat user cocok/berhenti; saat jatuh tempo cukup cek apakah sesinya
+# masih ada. Update Mongo bersyarat pada state supaya tidak menimpa transisi yang baru terjadi.
+async def reset_user_if(user_id, query):
+    result = await users.update_one({"_id": user_id, **query}, {"$set": {"state": "idle", "partner": None}})
+    if not result.modified_count:
+        return False
+    cached = user_cache.peek(user_id)
+    if cached is not None:
+        cached.update(state="idle", partner=None)
+    return True
+
+async def release_partner(user_id, partner_id):
+    # Bersyarat: partner yang sudah pergi dan dipasangkan lagi (mis. oleh worker lain) tidak ikut direset
+    return await reset_user_if(partner_id, {"state": "chatting", "partner": user_id})
+
+async def expire_user(bot, user_id, query, key):
+    if not await reset_user_if(user_id, query):
+        return False
+    lang = (await get_user(user_id)).get("language") or "id"
+    await bot.send_message(user_id, t(lang, key), reply_markup=REPLY_MARKUP)
+    return True
+
+async def expire_session(bot, key):
+    # Mode shared: sesi bisa diperbarui worker lain, jadi syarat waktunya ikut dicek di Mongo
+    now = datetime.utcnow()
+    if key[0] == "search":
+        user_id = key[1]
+        query = {"state": "searching"}
+        if SHARED_MATCHING:
+            query["searching_since"] = {"$lte": now - timedelta(seconds=SEARCH_TIMEOUT)}
+        elif not queue.cancel(user_id):
+            return
+        if await expire_user(bot, user_id, query, "search_timeout"):
+            SESSIONS_EXPIRED.inc(("search",))
+    else:
+        _, user_id, partner_id = key
+        idle = {}
+        if SHARED_MATCHING:
+            idle["active_at"] = {"$lt": now - timedelta(seconds=CHAT_IDLE_TIMEOUT)}
+        else:
+            route = routes.get(user_id)
+            if route is None or route.partner != partner_id:
+                return
+            close_route(user_id)
+        first = await expire_user(bot, user_id, {"state": "chatting", "partner": partner_id, **idle}, "chat_idle")
+        second = await expire_user(bot, partner_id, {"state": "chatting", "partner": user_id, **idle}, "chat_idle")
+        if first or second:
+            SESSIONS_EXPIRED.inc(("chat",))
+
 # (Lanjutan dari sebelumnya)
 
 # --- Handlers ---
 async def start(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if not user.get("language"):
-        await update.message.reply_text(TEXTS["start_lang"]["id"])
-        update_user(user_id, {"state": "awaiting_lang"})
+        await update.message.reply_text(t("id", "start_lang"))
+        await update_user(user_id, {"state": "awaiting_lang"})
         return
 
     lang = user["language"]
     if not user.get("gender"):
-        await update.message.reply_text(t(lang, "set_gender"), reply_markup=ReplyKeyboardMarkup(GENDER_KEYBOARD, resize_keyboard=True))
+        await update.message.reply_text(t(lang, "set_gender"), reply_markup=GENDER_MARKUP)
         return
 
     await update.message.reply_text(
         t(lang, "welcome"), parse_mode="Markdown",
-        reply_markup=ReplyKeyboardMarkup(REPLY_KEYBOARD, resize_keyboard=True)
+        reply_markup=REPLY_MARKUP
     )
 
 async def message_handler(update: Update, context: CallbackContext):
+    # Jalur cepat: pesan biasa dari user yang sedang chatting langsung diteruskan
+    route = routes.get(update.effective_user.id)
+    if (route is not None and update.message is not None and not is_control(update.message)
+            and relay_ready(update.effective_user.id)):
+        await relay(update.message, route, context)
+        return
+
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
     lang = user.get("language") or "id"
 
     # Deteksi user baru yang belum pilih bahasa
-    if not user.get("language"):
-        update_user(user_id, {"state": "awaiting_lang"})
-        await update.message.reply_text(TEXTS["start_lang"]["id"])
+    if not user.get("language") and user["state"] != "awaiting_lang":
+        await update_user(user_id, {"state": "awaiting_lang"})
+        await update.message.reply_text(t("id", "start_lang"))
         return
 
     text = (update.message.text or "").strip().lower()
@@ -179,11 +464,11 @@ async def message_handler(update: Update, context: CallbackContext):
 
     if user["state"] == "awaiting_lang":
         if text in ["id", "indonesia"]:
-            update_user(user_id, {"language": "id", "state": "idle"})
+            await update_user(user_id, {"language": "id", "state": "idle"})
             await update.message.reply_text("✅ Bahasa diatur ke Indonesia.")
             await start(update, context)
         elif text in ["en", "english"]:
-            update_user(user_id, {"language": "en", "state": "idle"})
+            await update_user(user_id, {"language": "en", "state": "idle"})
             await update.message.reply_text("✅ Language set to English.")
             await start(update, context)
         else:
@@ -191,46 +476,46 @@ async def message_handler(update: Update, context: CallbackContext):
         return
 
     if update.message.text in ["laki-laki", "perempuan"]:
-        update_user(user_id, {"gender": text})
-        await update.message.reply_text(t(lang, "saved"), reply_markup=ReplyKeyboardMarkup(REPLY_KEYBOARD, resize_keyboard=True))
+        await update_user(user_id, {"gender": text})
+        await update.message.reply_text(t(lang, "saved"), reply_markup=REPLY_MARKUP)
         return
 
     if update.message.text == "🔍 Find a Partner":
-        partner_id = match_partner(user_id)
+        partner_id = await match_partner(user_id)
         if partner_id:
-            await context.bot.send_message(user_id, t(lang, "found"))
-            await context.bot.send_message(partner_id, t(lang, "found"))
+            await context.bot.send_message(user_id, t(lang, "found"), rate_limit_args=PRIORITY_HIGH)
+            await context.bot.send_message(partner_id, t(lang, "found"), rate_limit_args=PRIORITY_HIGH)
         else:
             await update.message.reply_text(t(lang, "searching"))
         return
 
     if update.message.text == "👥 Search by Gender":
-        await update.message.reply_text(t(lang, "choose_target_gender"), reply_markup=ReplyKeyboardMarkup(GENDER_KEYBOARD, resize_keyboard=True))
-        update_user(user_id, {"state": "search_gender"})
+        await update.message.reply_text(t(lang, "choose_target_gender"), reply_markup=GENDER_MARKUP)
+        await update_user(user_id, {"state": "search_gender"})
         return
 
     if user["state"] == "search_gender" and text in ["laki-laki", "perempuan"]:
-        partner_id = match_partner_by_gender(user_id, text)
-        update_user(user_id, {"state": "idle"})
+        partner_id = await match_partner_by_gender(user_id, text)
         if partner_id:
-            await context.bot.send_message(user_id, t(lang, "found"))
-            await context.bot.send_message(partner_id, t(lang, "found"))
+            await context.bot.send_message(user_id, t(lang, "found"), rate_limit_args=PRIORITY_HIGH)
+            await context.bot.send_message(partner_id, t(lang, "found"), rate_limit_args=PRIORITY_HIGH)
         else:
             await update.message.reply_text(t(lang, "searching"))
         return
 
     if text == "/stop" or text == "/next":
         partner_id = user.get("partner")
-        if partner_id:
-            update_user(partner_id, {"state": "idle", "partner": None})
-            partner_lang = get_user(partner_id).get("language", "id")
+        close_route(user_id)
+        if partner_id and await release_partner(user_id, partner_id):
+            partner_lang = (await get_user(partner_id)).get("language", "id")
             await context.bot.send_message(partner_id, t(partner_lang, "stopped"))
-        update_user(user_id, {"state": "idle", "partner": None})
+        queue.cancel(user_id)
+        await update_user(user_id, {"state": "idle", "partner": None})
         if text == "/next":
-            partner_id = match_partner(user_id)
+            partner_id = await match_partner(user_id)
             if partner_id:
-                await context.bot.send_message(user_id, t(lang, "found"))
-                await context.bot.send_message(partner_id, t(lang, "found"))
+                await context.bot.send_message(user_id, t(lang, "found"), rate_limit_args=PRIORITY_HIGH)
+                await context.bot.send_message(partner_id, t(lang, "found"), rate_limit_args=PRIORITY_HIGH)
             else:
                 await update.message.reply_text(t(lang, "searching"))
         else:
@@ -238,9 +523,10 @@ async def message_handler(update: Update, context: CallbackContext):
         return
 
     if text == "/cancel":
-        if user_id in queue:
-            queue.remove(user_id)
-            update_user(user_id, {"state": "idle"})
+        if SHARED_MATCHING and await shared_queue.cancel(user_id):
+            await update.message.reply_text(t(lang, "cancelled"))
+        elif not SHARED_MATCHING and queue.cancel(user_id):
+            await update_user(user_id, {"state": "idle"})
             await update.message.reply_text(t(lang, "cancelled"))
         else:
             await update.message.reply_text(t(lang, "not_in_queue"))
@@ -249,98 +535,96 @@ async def message_handler(update: Update, context: CallbackContext):
     if text == "/report":
         partner_id = user.get("partner")
         if partner_id:
-            update_user(user_id, {"blocked": user.get("blocked", []) + [partner_id]})
-            update_user(user_id, {"state": "idle", "partner": None})
-            update_user(partner_id, {"state": "idle", "partner": None})
-            partner_lang = get_user(partner_id).get("language", "id")
+            close_route(user_id)
+            await block_user(user_id, partner_id)
+            await update_user(user_id, {"state": "idle", "partner": None})
             await context.bot.send_message(user_id, t(lang, "reported"))
-            await context.bot.send_message(partner_id, t(partner_lang, "you_reported"))
+            if await release_partner(user_id, partner_id):
+                partner_lang = (await get_user(partner_id)).get("language", "id")
+                await context.bot.send_message(partner_id, t(partner_lang, "you_reported"))
         return
 
-    # Kirim pesan antar user jika sedang chatting
+    # Kirim pesan antar user jika sedang chatting (route belum ada, mis. setelah restart)
     if user["state"] == "chatting" and user.get("partner"):
-        partner_id = user["partner"]
-        if update.message.text:
-            await context.bot.send_message(partner_id, update.message.text)
-        elif update.message.photo:
-            await context.bot.send_photo(partner_id, update.message.photo[-1].file_id)
-        elif update.message.video:
-            await context.bot.send_video(partner_id, update.message.video.file_id)
-        elif update.message.voice:
-            await context.bot.send_voice(partner_id, update.message.voice.file_id)
-        elif update.message.sticker:
-            await context.bot.send_sticker(partner_id, update.message.sticker.file_id)
+        partner = await get_user(user["partner"])
+        if partner.get("partner") == user_id:
+            open_route(user, partner)
+            if SHARED_MATCHING:
+                await mark_active(user, partner)
+            await relay(update.message, Route(partner["_id"], muted_media(partner)), context)
+
+# --- Stats Handler ---
+async def stats(update: Update, context: CallbackContext):
+    if update.effective_user.id != OWNER_ID:
+        return
+    cache = user_cache.stats()
+    if SHARED_MATCHING:
+        await refresh_shared_sizes()
+        searching, pairs = sum(shared_sizes.values()), shared_pairs
+    else:
+        searching, pairs = len(queue), len(routes) // 2
+    lines = [
+        "📊 Statistik Anonymous Bot",
+        f"Antrian: {searching} | Pasangan aktif: {pairs}",
+    ]
+    for (language, gender), size in sorted(search_queue_sizes().items(), key=str):
+        lines.append(f"  {language}/{gender}: {size}")
+    lines.append(f"Cache user: {cache['size']} entri, hit {cache['hit_ratio']:.0%}")
+    lines.append(f"Pengiriman: {context.bot.rate_limiter.stats()}")
+    lines.append("")
+    lines.extend(metrics.handler_summary("anon"))
+    await update.message.reply_text("\n".join(lines))
 
 # --- Settings Handler ---
 async def settings(update: Update, context: CallbackContext):
-    user = get_user(update.effective_user.id)
+    user = await get_user(update.effective_user.id)
     lang = user.get("language", "id")
-    keyboard = [
-        [InlineKeyboardButton("🧑 Jenis Kelamin", callback_data="set_gender"),
-         InlineKeyboardButton("🔞 Usia", callback_data="set_age")],
-        [InlineKeyboardButton(f"📷 Foto: {'✅' if user.get('photo', True) else '❌'}", callback_data="toggle_photo"),
-         InlineKeyboardButton(f"🎥 Video: {'✅' if user.get('video', True) else '❌'}", callback_data="toggle_video")],
-        [InlineKeyboardButton(f"🎭 Stiker: {'✅' if user.get('sticker', True) else '❌'}", callback_data="toggle_sticker"),
-         InlineKeyboardButton(f"🎤 Voice: {'✅' if user.get('voice', True) else '❌'}", callback_data="toggle_voice")],
-        [InlineKeyboardButton("✅ Aktifkan Semua", callback_data="enable_all"),
-         InlineKeyboardButton("❌ Blokir Semua", callback_data="disable_all")],
-        [InlineKeyboardButton("🌐 Bahasa", callback_data="set_lang")]
-    ]
-    await update.message.reply_text("⚙️ Pengaturan Media:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.message.reply_text(t(lang, "settings_title"), reply_markup=settings_markup(media_mask(user), lang))
 
 # --- Callback Handler ---
 async def callback_handler(update: Update, context: CallbackContext):
     query = update.callback_query
     user_id = query.from_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
     lang = user.get("language", "id")
     data = query.data
+    mask = media_mask(user)
 
-    toggles = {
-        "toggle_photo": "photo",
-        "toggle_video": "video",
-        "toggle_sticker": "sticker",
-        "toggle_voice": "voice"
-    }
-
-    if data in toggles:
-        field = toggles[data]
-        new_value = not user.get(field, True)
-        update_user(user_id, {field: new_value})
+    # Preferensi baru dihitung dari mask, tanpa membaca ulang user setelah update
+    if data in TOGGLES:
+        field = TOGGLES[data]
+        await update_user(user_id, {field: not mask & MEDIA_BITS[field]})
+        mask ^= MEDIA_BITS[field]
     elif data == "enable_all":
-        update_user(user_id, {"photo": True, "video": True, "sticker": True, "voice": True})
+        await update_user(user_id, MEDIA_ON)
+        mask = render.MEDIA_ALL
     elif data == "disable_all":
-        update_user(user_id, {"photo": False, "video": False, "sticker": False, "voice": False})
+        await update_user(user_id, MEDIA_OFF)
+        mask = 0
     elif data == "set_gender":
-        await context.bot.send_message(user_id, t(lang, "set_gender"), reply_markup=ReplyKeyboardMarkup(GENDER_KEYBOARD, resize_keyboard=True))
+        await context.bot.send_message(user_id, t(lang, "set_gender"), reply_markup=GENDER_MARKUP)
         return
     elif data == "set_age":
-        update_user(user_id, {"state": "awaiting_age"})
-        await context.bot.send_message(user_id, "Masukkan usia kamu (contoh: 20):")
+        await update_user(user_id, {"state": "awaiting_age"})
+        await context.bot.send_message(user_id, t(lang, "ask_age"))
         return
     elif data == "set_lang":
-        update_user(user_id, {"state": "awaiting_lang"})
-        await context.bot.send_message(user_id, TEXTS["start_lang"][lang])
+        await update_user(user_id, {"state": "awaiting_lang"})
+        await context.bot.send_message(user_id, t(lang, "start_lang"))
         return
 
-    updated_user = get_user(user_id)
-    keyboard = [
-        [InlineKeyboardButton("🧑 Jenis Kelamin", callback_data="set_gender"),
-         InlineKeyboardButton("🔞 Usia", callback_data="set_age")],
-        [InlineKeyboardButton(f"📷 Foto: {'✅' if updated_user.get('photo', True) else '❌'}", callback_data="toggle_photo"),
-         InlineKeyboardButton(f"🎥 Video: {'✅' if updated_user.get('video', True) else '❌'}", callback_data="toggle_video")],
-        [InlineKeyboardButton(f"🎭 Stiker: {'✅' if updated_user.get('sticker', True) else '❌'}", callback_data="toggle_sticker"),
-         InlineKeyboardButton(f"🎤 Voice: {'✅' if updated_user.get('voice', True) else '❌'}", callback_data="toggle_voice")],
-        [InlineKeyboardButton("✅ Aktifkan Semua", callback_data="enable_all"),
-         InlineKeyboardButton("❌ Blokir Semua", callback_data="disable_all")],
-        [InlineKeyboardButton("🌐 Bahasa", callback_data="set_lang")]
-    ]
-    await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    route = routes.get(user_id)
+    if route is not None and route.partner in routes:
+        routes[route.partner] = routes[route.partner]._replace(muted=MUTED[mask])
+    await query.edit_message_reply_markup(reply_markup=settings_markup(mask, lang))
     await query.answer()
     from telegram.ext import ApplicationBuilder
 
-async def start_anon_bot():
-    app = ApplicationBuilder().token(TOKEN).build()
+async def start_anon_bot(webhook=None):
+    app = (ApplicationBuilder().token(TOKEN)
+           .rate_limiter(SendScheduler(name="anon"))
+           .concurrent_updates(KeyedUpdateProcessor(update_keys, name="anon"))
+           .build())
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("cancel", message_handler))
@@ -348,11 +632,33 @@ async def start_anon_bot():
     app.add_handler(CommandHandler("stop", message_handler))
     app.add_handler(CommandHandler("next", message_handler))
     app.add_handler(CommandHandler("settings", settings))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("profile", profiler.profile_command))
     app.add_handler(MessageHandler(filters.ALL, message_handler))
     app.add_handler(CallbackQueryHandler(callback_handler))
+    metrics.instrument_app(app, "anon")
 
     print("🤖 Anonymous Bot is running...")
+    await load_blocks()
+    await (warm_start_shared() if SHARED_MATCHING else warm_start())
     await app.initialize()
     await app.start()
-    await app.updater.start_polling()
-
+    reaper.start(functools.partial(expire_session, app.bot))
+    if SHARED_MATCHING:
+        queue_sizer["stopping"] = asyncio.Event()
+        queue_sizer["task"] = asyncio.create_task(run_queue_sizer(queue_sizer["stopping"]))
+    if webhook is None:
+        await app.updater.start_polling()
+    else:
+        await webhook.add_bot("anon", app)
+    return app
+
+async def stop_anon_bot(app):
+    if app.updater.running:
+        await app.updater.stop()
+    await app.stop()
+    await reaper.stop()
+    if "task" in queue_sizer:
+        queue_sizer["stopping"].set()
+        await queue_sizer.pop("task")
+    await app.shutdown()
@@ -0,0 +1,86 @@
+import os
+import asyncio
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- ENV CONFIG ---
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))  # handler yang boleh jalan bersamaan per bot
+
+_processors = []
+metrics.Gauge("bot_updates_running", "Update yang sedang diproses handler",
+              lambda: {(processor.name,): processor.running for processor in _processors}, ("bot",))
+metrics.Gauge("bot_updates_waiting", "Update yang menunggu giliran key atau slot",
+              lambda: {(processor.name,): processor.waiting for processor in _processors}, ("bot",))
+
+
+def user_keys(update):
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return (user.id,)
+    chat = getattr(update, "effective_chat", None)
+    return (chat.id,) if chat is not None else ()
+
+
+# --- KEYED UPDATE PROCESSOR ---
+# Update dari user berbeda diproses bersamaan, update dengan key yang sama tetap berurutan.
+# Setiap update mendaftar sebagai ekor antrian untuk semua key-nya secara sinkron (urutan
+# datang dari update_queue), lalu menunggu ekor sebelumnya selesai. Karena semua key didaftar
+# sekaligus dalam urutan datang, menunggu beberapa key (user + partner) tidak bisa deadlock.
+# Semaphore bawaan PTB dibuat longgar; batas konkurensi sebenarnya diambil setelah giliran
+# key didapat, supaya update yang sedang mengantre tidak memakan slot.
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, key_fn=user_keys, max_concurrent=UPDATE_CONCURRENCY, name="bot"):
+        super().__init__(max_concurrent_updates=2 ** 16)
+        self.key_fn = key_fn
+        self.name = name
+        self.limit = max_concurrent
+        self._slots = asyncio.BoundedSemaphore(max_concurrent)
+        self._tails = {}  # key -> future milik update terakhir dengan key itu
+        self.running = 0
+        self.waiting = 0
+        _processors.append(self)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            keys = set(self.key_fn(update))
+        except Exception:
+            logger.exception("Gagal menentukan key update")
+            keys = set()
+        done = asyncio.get_running_loop().create_future()
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        for key in keys:
+            self._tails[key] = done
+
+        started = False
+        self.waiting += 1
+        try:
+            if previous:
+                # asyncio.wait tidak ikut membatalkan future milik update lain
+                await asyncio.wait(previous)
+            async with self._slots:
+                self.waiting -= 1
+                self.running += 1
+                started = True
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+                coroutine.close()
+            done.set_result(None)
+            for key in keys:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+
+# --- FAKE BOT API ---
+# Pengganti lokal untuk telegram.Bot: setiap method API (send_message, copy_message, ...)
+# dicatat di `calls` tanpa jaringan. Bisa dipasangi rate limiter yang sama dengan bot asli
+# dan bisa mensimulasikan flood control Telegram (RetryAfter) per chat.
+class FakeBot:
+    def __init__(self, rate_limiter=None, chat_flood_limit=None, latency=0.0, bot_id=1, username="fake_bot"):
+        self.rate_limiter = rate_limiter
+        self.chat_flood_limit = chat_flood_limit  # maksimal pesan per chat per detik sebelum RetryAfter
+        self.latency = latency
+        self.id = bot_id
+        self.username = username
+        self.defaults = None
+        self.calls = []
+        self.flood_errors = 0
+        self._message_ids = itertools.count(1)
+        self._recent = defaultdict(deque)
+
+    def _camel(self, name):
+        head, *rest = name.split("_")
+        return head + "".join(part.title() for part in rest)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        endpoint = self._camel(name)
+
+        async def method(*args, rate_limit_args=None, **kwargs):
+            data = dict(kwargs)
+            if args:
+                data.setdefault("chat_id", args[0])
+                data["args"] = args[1:]
+            return await self._request(endpoint, data, rate_limit_args)
+
+        return method
+
+    async def _request(self, endpoint, data, rate_limit_args=None):
+        if self.rate_limiter is not None:
+            return await self.rate_limiter.process_request(
+                self._post, (endpoint, data), {}, endpoint, data, rate_limit_args
+            )
+        return await self._post(endpoint, data)
+
+    async def _post(self, endpoint, data):
+        chat_id = data.get("chat_id")
+        if self.chat_flood_limit is not None and chat_id is not None:
+            now = time.monotonic()
+            recent = self._recent[chat_id]
+            while recent and now - recent[0] > 1:
+                recent.popleft()
+            if len(recent) >= self.chat_flood_limit:
+                self.flood_errors += 1
+                raise RetryAfter(1)
+            recent.append(now)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append((endpoint, data))
+        if endpoint == "getChat":
+            return SimpleNamespace(id=chat_id, username=f"user{chat_id}", full_name=f"User {chat_id}")
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id)
+
+    def sent_to(self, chat_id):
+        return [call for call in self.calls if call[1].get("chat_id") == chat_id]
+
+
+# --- SYNTHETIC UPDATES ---
+_update_ids = itertools.count(1)
+_fake_message_ids = itertools.count(1)
+
+
+def make_user(user_id, first_name=None, username=None):
+    return {"id": user_id, "is_bot": False, "first_name": first_name or f"User{user_id}",
+            "username": username or f"user{user_id}"}
+
+
+def make_message_update(user_id, text=None, **extra):
+    message = {
+        "message_id": next(_fake_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": make_user(user_id),
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    message.update(extra)
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def make_callback_update(user_id, data, message_id=1):
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}},
+        },
+    }
+
+
+# --- WEBHOOK CLIENT ---
+# Mengirim update sintetis ke WebhookServer lewat HTTP, seperti yang dilakukan Telegram.
+async def post_updates(host, port, path, updates, secret=None):
+    reader, writer = await asyncio.open_connection(host, port)
+    statuses = []
+    try:
+        for update in updates:
+            body = json.dumps(update).encode()
+            head = (f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n")
+            if secret:
+                head += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+            writer.write(head.encode() + b"\r\n" + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            statuses.append(int(status_line.split()[1]))
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return statuses
+
+
+async def _main(args):
+    updates = []
+    for user_id in range(1, args.users + 1):
+        updates.append(make_message_update(user_id, "/start"))
+        for n in range(args.messages):
+            updates.append(make_message_update(user_id, f"pesan {n}"))
+    secret = args.secret
+    if not secret:
+        # Sama dengan server: tanpa WEBHOOK_SECRET, secret diturunkan dari token bot tujuan
+        from webhook import webhook_secret
+        secret = webhook_secret(os.getenv("BOT_TOKEN1" if args.path == "/support" else "BOT_TOKEN", ""))
+    started = time.monotonic()
+    statuses = await post_updates(args.host, args.port, args.path, updates, secret)
+    elapsed = time.monotonic() - started
+    print(json.dumps({"posted": len(statuses), "ok": statuses.count(200), "seconds": round(elapsed, 3)}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kirim update sintetis ke webhook bot lokal")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--path", default="/anon")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5)
+    asyncio.run(_main(parser.parse_args()))
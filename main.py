@@ -1,14 +1,84 @@
 # main.py
+# Kedua bot dalam satu proses; supervisor.py menjalankan tiap bot di prosesnya sendiri.
 
+import signal
 import asyncio
-from support import start_support_bot
-from bot import start_anon_bot
+import logging
+import multiprocessing
+from support import start_support_bot, stop_support_bot
+from bot import start_anon_bot, stop_anon_bot, SHARED_MATCHING, MONGO_URI
+from webhook import WebhookServer, WEBHOOK_URL, ANON_WORKERS, ANON_WORKER_PORT
+from metrics import METRICS_PORT, METRICS_LISTEN, handle_metrics
+from storage import serve_memory
+
+SHUTDOWN_TIMEOUT = 30  # detik menunggu worker anon berhenti sebelum di-kill
+
+async def wait_for_signal():
+    # SIGTERM (docker/systemd) dan SIGINT sama-sama berakhir dengan shutdown yang rapi
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+async def anon_worker(index):
+    webhook = WebhookServer(port=ANON_WORKER_PORT, register=index == 0)
+    app = await start_anon_bot(webhook)
+    await webhook.start(reuse_port=True)
+    await wait_for_signal()
+    await webhook.stop()
+    await stop_anon_bot(app)
+
+def run_anon_worker(index):
+    asyncio.run(anon_worker(index))
+
+def spawn_anon_workers():
+    if not WEBHOOK_URL or not SHARED_MATCHING:
+        logging.error("ANON_WORKERS=%d butuh WEBHOOK_URL dan MATCH_BACKEND=shared, pakai satu worker", ANON_WORKERS)
+        return None
+    if MONGO_URI.startswith("memory://") and MONGO_URI != "memory://":
+        serve_memory(MONGO_URI[len("memory://"):])
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_anon_worker, args=(index,), name=f"anon-{index}", daemon=True)
+               for index in range(ANON_WORKERS)]
+    for worker in workers:
+        worker.start()
+    return workers
 
 async def main():
-    await asyncio.gather(
-        start_anon_bot(),    # ← tambahkan tanda kurung untuk menjalankan coroutine
-        start_support_bot()
-    )
+    # WEBHOOK_URL di-set: kedua bot dilayani satu server webhook, selain itu long polling
+    webhook = WebhookServer() if WEBHOOK_URL else None
+    workers = spawn_anon_workers() if ANON_WORKERS > 1 else None
+    anon_app = None
+    if workers is None:
+        anon_app, support_app = await asyncio.gather(
+            start_anon_bot(webhook),    # ← tambahkan tanda kurung untuk menjalankan coroutine
+            start_support_bot(webhook)
+        )
+    else:
+        support_app = await start_support_bot(webhook)
+    if webhook is not None:
+        await webhook.start()
+    # /metrics di port internal terpisah (default hanya localhost), bukan di port webhook publik
+    metrics_server = WebhookServer(host=METRICS_LISTEN, port=METRICS_PORT) if METRICS_PORT else None
+    if metrics_server is not None:
+        metrics_server.add_route("GET", "/metrics", handle_metrics)
+        await metrics_server.start()
+    await wait_for_signal()
+    logging.info("Menghentikan bot...")
+    for server in (webhook, metrics_server):
+        if server is not None:
+            await server.stop()
+    for worker in workers or ():
+        worker.terminate()
+    # Polling/updater dan reaper berhenti, buffer pesan, reply index dan counter support tertulis
+    if anon_app is not None:
+        await stop_anon_bot(anon_app)
+    await stop_support_bot(support_app)
+    for worker in workers or ():
+        await asyncio.get_running_loop().run_in_executor(None, worker.join, SHUTDOWN_TIMEOUT)
+        if worker.is_alive():
+            worker.kill()
 
 if __name__ == "__main__":
     asyncio.run(main())
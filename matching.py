@@ -0,0 +1,223 @@
+import logging
+import itertools
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+# --- Block Index ---
+# Relasi blokir disimpan simetris (a memblokir b => a dan b tidak boleh dipasangkan),
+# jadi cek saat matching cukup satu lookup set.
+class BlockIndex:
+    _EMPTY = frozenset()
+
+    def __init__(self):
+        self._related = {}  # user_id -> set(user_id)
+        self.pairs = 0
+
+    def add(self, blocker, blocked):
+        related = self._related.setdefault(blocker, set())
+        if blocked in related:
+            return False
+        related.add(blocked)
+        self._related.setdefault(blocked, set()).add(blocker)
+        self.pairs += 1
+        return True
+
+    def related(self, user_id):
+        return self._related.get(user_id, self._EMPTY)
+
+    def is_blocked(self, a, b):
+        return b in self._related.get(a, self._EMPTY)
+
+
+# --- Matchmaking Engine ---
+# User yang menunggu disimpan di pool FIFO per (language, gender, target_gender).
+# Tiap pool berupa dict biasa (urut sesuai waktu masuk), jadi enqueue/cancel O(1) dan
+# penunggu tertua selalu key pertama. Pencarian hanya melihat kepala beberapa pool yang
+# cocok dengan pencari, tidak pernah seluruh antrian.
+class MatchEngine:
+    def __init__(self, blocks=None):
+        self._pools = {}    # (language, gender, target) -> {user_id: seq}
+        self._entries = {}  # user_id -> (pool_key, seq)
+        self._seq = itertools.count()
+        self.blocks = blocks if blocks is not None else BlockIndex()
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def pool_sizes(self):
+        return {key: len(pool) for key, pool in self._pools.items() if pool}
+
+    def enqueue(self, user_id, language, gender, target=None):
+        self.cancel(user_id)
+        key = (language, gender, target)
+        seq = next(self._seq)
+        self._entries[user_id] = (key, seq)
+        self._pools.setdefault(key, {})[user_id] = seq
+
+    def cancel(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+        key = entry[0]
+        pool = self._pools[key]
+        del pool[user_id]
+        if not pool:
+            del self._pools[key]
+        return True
+
+    def _candidate_keys(self, language, gender, target):
+        for key in self._pools:
+            lang, their_gender, their_target = key
+            if lang != language:
+                continue
+            if target is not None and their_gender != target:
+                continue
+            if their_target is not None and their_target != gender:
+                continue
+            yield key
+
+    def match(self, user_id, language, gender, target=None):
+        # Ambil waiter tertua dari semua pool yang cocok (FIFO antar pool)
+        best_id, best_seq = None, None
+        blocked = self.blocks.related(user_id)
+        for key in self._candidate_keys(language, gender, target):
+            for partner_id, seq in self._pools[key].items():
+                if best_seq is not None and seq > best_seq:
+                    break
+                if partner_id == user_id or partner_id in blocked:
+                    continue
+                best_id, best_seq = partner_id, seq
+                break
+        if best_id is not None:
+            self.cancel(best_id)
+        return best_id
+
+
+# --- Shared Matching (multi-worker) ---
+# Dipakai saat beberapa proses worker melayani bot yang sama. Antriannya adalah koleksi users
+# itu sendiri (state "searching" urut searching_since) dan setiap transisi berupa compare-and-set
+# atomik pada dokumen user, jadi dua worker tidak pernah bisa mengambil user yang sama:
+#   1. kunci diri sendiri: state (bukan chatting/matching) -> "matching"
+#   2. klaim waiter tertua yang cocok: "searching" -> "chatting" (find_one_and_update)
+#   3. diri sendiri -> "chatting" bila dapat, selain itu -> "searching"
+# Dua pencari yang mengunci diri bersamaan bisa sama-sama masuk antrian tanpa saling melihat,
+# jadi setelah masuk antrian klaim diulang sekali (_claim_parked): partner diklaim dulu, lalu
+# diri sendiri dipindah dengan CAS pada entri "searching" milik sendiri. Bila kita sudah diklaim
+# lebih dulu, klaim kita dikembalikan; bila keduanya saling klaim, hasilnya tetap satu pasangan.
+# Kunci "matching" punya lease (matching_since): bila langkah 2/3 gagal, state sebelumnya
+# dikembalikan; bila worker mati di tengah jalan, kunci yang lebih tua dari lease boleh diambil alih.
+class SharedMatchEngine:
+    def __init__(self, users, blocks, index=None, lease=30):
+        self.users = users
+        self.blocks = blocks
+        self.index = index if index is not None else BlockIndex()
+        self.lease = timedelta(seconds=lease)
+
+    async def ensure_indexes(self):
+        await self.users.create_index([("state", 1), ("language", 1), ("searching_since", 1)])
+
+    async def _excluded(self, user_id):
+        # Blokir dari worker lain belum tentu ada di index lokal, jadi baca juga koleksi blocks
+        excluded = {user_id, *self.index.related(user_id)}
+        query = {"$or": [{"blocker": user_id}, {"blocked": user_id}]}
+        async for block in self.blocks.find(query, {"blocker": 1, "blocked": 1, "_id": 0}):
+            self.index.add(block["blocker"], block["blocked"])
+            excluded.update((block["blocker"], block["blocked"]))
+        return list(excluded)
+
+    async def match(self, user_id, language, gender, target=None):
+        # Hasil: dokumen partner, atau None bila user masuk antrian
+        now = datetime.utcnow()
+        before = await self.users.find_one_and_update(
+            {"_id": user_id, "$or": [{"state": {"$nin": ["chatting", "matching"]}},
+                                     {"state": "matching", "matching_since": {"$lt": now - self.lease}}]},
+            {"$set": {"state": "matching", "matching_since": now}}, projection={"state": 1}
+        )
+        if before is None:
+            me = await self.users.find_one({"_id": user_id}, {"state": 1, "partner": 1})
+            if me and me.get("state") == "chatting" and me.get("partner"):
+                # Sudah diklaim worker lain tepat sebelum ini
+                return await self.users.find_one({"_id": me["partner"]})
+            return None
+
+        lock = {"_id": user_id, "state": "matching", "matching_since": now}
+        partner = None
+        try:
+            query = {"state": "searching", "language": language, "_id": {"$nin": await self._excluded(user_id)},
+                     "search_target": {"$in": [None, gender]}}
+            if target is not None:
+                query["gender"] = target
+            partner = await self.users.find_one_and_update(
+                query, {"$set": {"state": "chatting", "partner": user_id, "active_at": now}},
+                sort=[("searching_since", 1)], return_document=ReturnDocument.AFTER
+            )
+            if partner is not None:
+                await self.users.update_one(lock, {"$set": {"state": "chatting", "partner": partner["_id"], "active_at": now}})
+                return partner
+            await self.users.update_one(lock, {"$set": {"state": "searching", "search_target": target,
+                                                        "searching_since": now}})
+        except Exception:
+            await self._unlock(lock, before.get("state"), partner)
+            raise
+        return await self._claim_parked(user_id, query, now)
+
+    async def _claim_parked(self, user_id, query, since):
+        parked = {"_id": user_id, "state": "searching", "searching_since": since}
+        partner = await self.users.find_one_and_update(
+            query, {"$set": {"state": "chatting", "partner": user_id, "active_at": datetime.utcnow()}},
+            sort=[("searching_since", 1)], return_document=ReturnDocument.AFTER
+        )
+        if partner is None:
+            return None
+        try:
+            moved = await self.users.update_one(parked, {"$set": {"state": "chatting", "partner": partner["_id"],
+                                                                  "active_at": partner["active_at"]}})
+            if moved.modified_count:
+                return partner
+            me = await self.users.find_one({"_id": user_id}, {"state": 1, "partner": 1})
+        except Exception:
+            me = None
+        if me and me.get("state") == "chatting" and me.get("partner") == partner["_id"]:
+            # Saling klaim pada saat bersamaan: sudah jadi satu pasangan
+            return partner
+        # Kita sudah diklaim pencari lain (atau keluar antrian): partner dikembalikan ke antrian
+        try:
+            await self.users.update_one({"_id": partner["_id"], "state": "chatting", "partner": user_id},
+                                        {"$set": {"state": "searching", "partner": None}})
+        except Exception:
+            logger.exception("Gagal mengembalikan %s ke antrian", partner["_id"])
+        if me and me.get("state") == "chatting" and me.get("partner"):
+            return await self.users.find_one({"_id": me["partner"]})
+        return None
+
+    async def _unlock(self, lock, previous, partner):
+        # Operasi yang timeout bisa saja sudah diterapkan: semuanya bersyarat pada kunci milik kita,
+        # dan partner hanya dilepas bila kita memang belum jadi chatting
+        if previous in (None, "matching"):
+            previous = "idle"
+        try:
+            restored = await self.users.update_one(lock, {"$set": {"state": previous}})
+            if restored.modified_count and partner is not None:
+                await self.users.update_one({"_id": partner["_id"], "state": "chatting", "partner": lock["_id"]},
+                                            {"$set": {"state": "searching", "partner": None}})
+        except Exception:
+            logger.exception("Gagal melepas kunci matching %s, menunggu lease habis", lock["_id"])
+
+    async def pool_sizes(self):
+        # Hitung antrian per (language, gender, target) dari user "searching" (lewat index state)
+        sizes = {}
+        async for user in self.users.find({"state": "searching"}, {"language": 1, "gender": 1, "search_target": 1}):
+            key = (user.get("language"), user.get("gender"), user.get("search_target"))
+            sizes[key] = sizes.get(key, 0) + 1
+        return sizes
+
+    async def cancel(self, user_id):
+        result = await self.users.update_one({"_id": user_id, "state": "searching"}, {"$set": {"state": "idle"}})
+        return result.modified_count > 0
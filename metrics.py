@@ -0,0 +1,172 @@
+import os
+import time
+import bisect
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+# --- ENV CONFIG ---
+# /metrics selalu di server internal sendiri, tidak pernah di port webhook publik
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # port endpoint /metrics (0 = mati)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# --- METRIC TYPES ---
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [counts per bucket (+Inf terakhir), sum, count]
+        _registry.append(self)
+
+    def observe(self, labels, value):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, labels, q):
+        # Perkiraan kasar: batas atas bucket tempat kuantil q jatuh
+        series = self.values.get(labels)
+        if not series or not series[2]:
+            return 0.0
+        target, running = q * series[2], 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[0]):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self.values.items():
+            running = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                running += bucket_count
+                le = _format_labels(self.labels + ("le",), labels + (bound,))
+                yield f"{self.name}_bucket{le} {running}"
+            label_text = _format_labels(self.labels, labels)
+            yield f"{self.name}_sum{label_text} {total}"
+            yield f"{self.name}_count{label_text} {count}"
+
+
+class Gauge:
+    # Nilai diambil dari callback saat scrape: fn() -> {labels_tuple: value}
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        _registry.append(self)
+
+    def collect(self):
+        try:
+            return self.fn()
+        except Exception:
+            logger.exception("Gagal membaca gauge %s", self.name)
+            return {}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self.collect().items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+# --- STANDARD METRICS ---
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Latensi handler update", ("bot", "handler"))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Exception yang lolos dari handler", ("bot", "handler"))
+MONGO_SECONDS = Histogram("mongo_operation_seconds", "Latensi operasi Mongo", ("op",))
+MONGO_ERRORS = Counter("mongo_operation_errors_total", "Operasi Mongo yang gagal", ("op",))
+TELEGRAM_SECONDS = Histogram("telegram_request_seconds", "Latensi request Bot API", ("bot", "endpoint"))
+
+# Dipasang profiler.py selama sesi /profile: update_hook(labels, detik) setelah tiap handler
+update_hook = None
+
+
+def instrument(bot_name, handler):
+    name = getattr(handler, "__name__", type(handler).__name__)
+    labels = (bot_name, name)
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(labels, elapsed)
+            if update_hook is not None:
+                update_hook(labels, elapsed)
+
+    return wrapper
+
+
+def instrument_app(app, bot_name):
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument(bot_name, handler.callback)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(headers, body):
+    return 200, "text/plain; version=0.0.4", render().encode()
+
+
+def handler_summary(bot_name):
+    rows = []
+    for labels, (counts, total, count) in sorted(HANDLER_SECONDS.values.items()):
+        if labels[0] != bot_name:
+            continue
+        errors = HANDLER_ERRORS.values.get(labels, 0)
+        p50 = HANDLER_SECONDS.quantile(labels, 0.5) * 1000
+        p99 = HANDLER_SECONDS.quantile(labels, 0.99) * 1000
+        rows.append(f"{labels[1]}: n={count} avg={total / count * 1000:.1f}ms p50≤{p50:g}ms p99≤{p99:g}ms err={errors}")
+    return rows
@@ -0,0 +1,151 @@
+import io
+import os
+import time
+import pstats
+import asyncio
+import cProfile
+import logging
+from datetime import datetime
+
+from dotenv import load_dotenv
+from telegram import InputFile
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- ENV CONFIG ---
+OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))          # durasi default /profile
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_TOP = 30  # baris fungsi per tabel di laporan
+
+# --- PROFILE SESSION ---
+# /profile [detik] [jumlah update]: cProfile aktif di thread event loop selama N detik atau sampai
+# N update selesai (mana yang lebih dulu). Di mode main.py kedua bot berbagi loop sehingga ikut
+# terprofil; di mode supervisor hanya proses bot yang menerima perintah. Waktu Mongo/Telegram
+# diambil dari selisih histogram metrics (thread executor Mongo tidak terlihat oleh cProfile),
+# CPU dari process_time. Saat tidak ada sesi, satu-satunya biaya adalah cek None di
+# metrics.instrument. cProfile memperlambat handler selama sesi, jadi durasi dibatasi.
+_session = None
+
+
+def _histogram_totals(histogram, key):
+    totals = {}
+    for labels, (_, total, count) in histogram.values.items():
+        name = key(labels)
+        seconds, calls = totals.get(name, (0.0, 0))
+        totals[name] = (seconds + total, calls + count)
+    return totals
+
+
+def _delta(after, before):
+    rows = []
+    for name, (seconds, calls) in after.items():
+        old_seconds, old_calls = before.get(name, (0.0, 0))
+        if calls > old_calls:
+            rows.append((seconds - old_seconds, calls - old_calls, name))
+    rows.sort(reverse=True)
+    return rows
+
+
+class ProfileSession:
+    def __init__(self, seconds, max_updates=0):
+        self.seconds = seconds
+        self.max_updates = max_updates
+        self.updates = 0
+        self.done = asyncio.Event()
+        self.profile = cProfile.Profile()
+        self.task = None
+
+    def _snapshot(self):
+        return {
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "handlers": _histogram_totals(metrics.HANDLER_SECONDS, lambda labels: f"{labels[0]}/{labels[1]}"),
+            "mongo": _histogram_totals(metrics.MONGO_SECONDS, lambda labels: labels[0]),
+            "telegram": _histogram_totals(metrics.TELEGRAM_SECONDS, lambda labels: f"{labels[0]}/{labels[1]}"),
+        }
+
+    def on_update(self, labels, elapsed):
+        self.updates += 1
+        if self.max_updates and self.updates >= self.max_updates:
+            self.done.set()
+
+    async def run(self):
+        before = self._snapshot()
+        self.profile.enable()
+        metrics.update_hook = self.on_update
+        try:
+            await asyncio.wait_for(self.done.wait(), self.seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            metrics.update_hook = None
+            self.profile.disable()
+        return self.report(before, self._snapshot())
+
+    def report(self, before, after):
+        wall = after["wall"] - before["wall"]
+        cpu = after["cpu"] - before["cpu"]
+        handlers = _delta(after["handlers"], before["handlers"])
+        mongo = _delta(after["mongo"], before["mongo"])
+        telegram = _delta(after["telegram"], before["telegram"])
+        handler_seconds = sum(row[0] for row in handlers)
+
+        out = io.StringIO()
+        out.write(f"Profil {datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC, pid {os.getpid()}\n")
+        out.write(f"Durasi {wall:.1f}s, {self.updates} update, CPU proses {cpu:.2f}s ({cpu / wall:.0%} dari wall)\n")
+        out.write(f"Waktu handler {handler_seconds:.2f}s | Mongo {sum(row[0] for row in mongo):.2f}s | "
+                  f"Telegram {sum(row[0] for row in telegram):.2f}s "
+                  f"(jumlah latensi, bisa melebihi durasi karena berjalan bersamaan)\n")
+        for title, rows in (("Handler", handlers), ("Mongo", mongo), ("Telegram", telegram)):
+            out.write(f"\n== {title} (total / jumlah / rata-rata) ==\n")
+            for seconds, calls, name in rows:
+                out.write(f"{name:40} {seconds:9.3f}s {calls:7d} {seconds / calls * 1000:9.2f}ms\n")
+
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.strip_dirs()
+        out.write("\n== Fungsi teratas (waktu sendiri, event loop) ==\n")
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+        out.write("\n== Fungsi teratas (kumulatif) ==\n")
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        return out.getvalue()
+
+
+async def run_profile(bot, chat_id, session):
+    global _session
+    try:
+        report = await session.run()
+        name = f"profile-{datetime.utcnow():%Y%m%d-%H%M%S}.txt"
+        await bot.send_document(chat_id, InputFile(io.BytesIO(report.encode()), filename=name),
+                                caption=f"🔬 Profil selesai: {session.updates} update")
+    except Exception:
+        logger.exception("Sesi profil gagal")
+        await bot.send_message(chat_id, "⚠️ Sesi profil gagal, lihat log.")
+    finally:
+        _session = None
+
+
+async def profile_command(update, context):
+    global _session
+    if update.effective_user.id != OWNER_ID:
+        return
+    if _session is not None:
+        await update.message.reply_text("⏳ Sesi profil lain masih berjalan.")
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_SECONDS
+        max_updates = int(context.args[1]) if len(context.args) > 1 else 0
+    except ValueError:
+        await update.message.reply_text("Format: /profile [detik] [jumlah update]")
+        return
+    seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+
+    _session = ProfileSession(seconds, max_updates)
+    # Di task terpisah supaya update owner berikutnya tidak tertahan di antrian per-user
+    _session.task = asyncio.create_task(run_profile(context.bot, update.effective_chat.id, _session))
+    limit = f" atau {max_updates} update" if max_updates else ""
+    await update.message.reply_text(f"🔬 Profil berjalan {seconds:g} detik{limit}...")
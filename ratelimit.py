@@ -0,0 +1,188 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- ENV CONFIG ---
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))        # pesan/detik per bot
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))             # pesan/detik per private chat
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))  # pesan/detik per grup
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# rate_limit_args untuk ExtBot (0 tidak bisa dipakai: PTB membuang nilai falsy)
+PRIORITY_HIGH = 1    # partner found, relay chat
+PRIORITY_NORMAL = 2
+PRIORITY_BULK = 3    # broadcast dan trafik massal lain
+
+LIMITED_PREFIXES = ("send", "copy", "forward", "editMessage")
+
+_schedulers = []
+metrics.Gauge("telegram_send_queue_depth", "Request yang menunggu token global",
+              lambda: {(scheduler.name,): len(scheduler._heap) for scheduler in _schedulers}, ("bot",))
+metrics.Gauge("telegram_send_retries", "Jumlah RetryAfter yang diterima",
+              lambda: {(scheduler.name,): scheduler.retries for scheduler in _schedulers}, ("bot",))
+
+
+# --- TOKEN BUCKET ---
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self):
+        # Ambil satu token (boleh berutang); hasilnya lama menunggu giliran, FIFO per bucket
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+# --- SEND SCHEDULER ---
+class SendScheduler(BaseRateLimiter):
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 group_rate=SEND_GROUP_RATE, max_retries=SEND_MAX_RETRIES, name="bot"):
+        self.name = name
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._max_retries = max_retries
+        self._chats = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher = None
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        _schedulers.append(self)
+
+    async def _call(self, endpoint, callback, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            metrics.TELEGRAM_SECONDS.observe((self.name, endpoint), time.perf_counter() - started)
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        while self._heap:
+            future = heapq.heappop(self._heap)[2]
+            if not future.done():
+                future.cancel()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full()}
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self._group_rate, 1)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(LIMITED_PREFIXES):
+            return await self._call(endpoint, callback, args, kwargs)
+        if self._dispatcher is None:
+            await self.initialize()
+
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+        priority = rate_limit_args or PRIORITY_NORMAL
+        enqueued_at = time.monotonic()
+        for attempt in range(self._max_retries + 1):
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (priority, next(self._seq), future))
+            self._ready.set()
+            await future
+            try:
+                result = await self._call(endpoint, callback, args, kwargs)
+            except RetryAfter as exc:
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after)
+                logger.warning("[%s] Flood wait %ss pada %s (percobaan %d)", self.name, exc.retry_after, endpoint, attempt + 1)
+                if attempt == self._max_retries:
+                    self.failed += 1
+                    raise
+                await asyncio.sleep(exc.retry_after)
+                continue
+            except Exception:
+                self.failed += 1
+                raise
+            latency = time.monotonic() - enqueued_at
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            return result
+
+    async def _dispatch(self):
+        # Melepas request sesuai prioritas, dengan laju global token bucket
+        while True:
+            await self._ready.wait()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = self._global.wait_time()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            future = heapq.heappop(self._heap)[2]
+            if not self._heap:
+                self._ready.clear()
+            if future.cancelled():
+                continue
+            self._global.reserve()
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._heap),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "latency_avg": round(self.latency_total / self.sent, 4) if self.sent else 0.0,
+            "latency_max": round(self.latency_max, 4),
+        }
@@ -0,0 +1,63 @@
+from telegram import ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+
+# --- RENDER CACHE ---
+# Semua markup statis dan teks per bahasa dibangun sekali saat start. Objek telegram v20
+# immutable setelah dibuat, jadi satu instance aman dipakai bersama oleh semua update.
+# Keyboard pengaturan punya 2^4 varian per bahasa, diindeks bitmask preferensi media.
+LANGUAGES = ("id", "en")
+DEFAULT_LANGUAGE = "id"
+MEDIA_FIELDS = ("photo", "video", "sticker", "voice")
+MEDIA_ALL = (1 << len(MEDIA_FIELDS)) - 1
+MEDIA_BITS = {field: 1 << bit for bit, field in enumerate(MEDIA_FIELDS)}
+
+GENDER_KEYBOARD = [["Laki-laki", "Perempuan"]]
+REPLY_KEYBOARD = [["🔍 Find a Partner", "👥 Search by Gender"], ["⚙️ Settings"]]
+GENDER_MARKUP = ReplyKeyboardMarkup(GENDER_KEYBOARD, resize_keyboard=True)
+REPLY_MARKUP = ReplyKeyboardMarkup(REPLY_KEYBOARD, resize_keyboard=True)
+
+# mask -> jenis media yang dimatikan (bit 0 = dimatikan)
+MUTED = tuple(frozenset(field for field, bit in MEDIA_BITS.items() if not mask & bit) for mask in range(MEDIA_ALL + 1))
+
+_texts = {}     # lang -> {key: teks}
+_settings = {}  # lang -> tuple markup pengaturan per mask
+
+
+def media_mask(user):
+    mask = 0
+    for field, bit in MEDIA_BITS.items():
+        if user.get(field, True):
+            mask |= bit
+    return mask
+
+
+def _settings_markup(mask, texts):
+    def toggle(field):
+        state = "✅" if mask & MEDIA_BITS[field] else "❌"
+        return InlineKeyboardButton(f"{texts['media_' + field]}: {state}", callback_data=f"toggle_{field}")
+
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(texts["settings_gender"], callback_data="set_gender"),
+         InlineKeyboardButton(texts["settings_age"], callback_data="set_age")],
+        [toggle("photo"), toggle("video")],
+        [toggle("sticker"), toggle("voice")],
+        [InlineKeyboardButton(texts["settings_enable_all"], callback_data="enable_all"),
+         InlineKeyboardButton(texts["settings_disable_all"], callback_data="disable_all")],
+        [InlineKeyboardButton(texts["settings_language"], callback_data="set_lang")]
+    ])
+
+
+def compile_texts(texts):
+    # texts: {key: {lang: teks}}; bahasa yang tidak ada jatuh ke DEFAULT_LANGUAGE, lalu ke key
+    for lang in LANGUAGES:
+        _texts[lang] = {key: variants.get(lang, variants.get(DEFAULT_LANGUAGE, key)) for key, variants in texts.items()}
+        _settings[lang] = tuple(_settings_markup(mask, _texts[lang]) for mask in range(MEDIA_ALL + 1))
+
+
+def text(lang, key):
+    texts = _texts.get(lang) or _texts[DEFAULT_LANGUAGE]
+    return texts.get(key, key)
+
+
+def settings_markup(mask, lang):
+    markups = _settings.get(lang) or _settings[DEFAULT_LANGUAGE]
+    return markups[mask]
@@ -0,0 +1,707 @@
+import os
+import asyncio
+import copy
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from functools import partial
+from multiprocessing.managers import BaseManager
+
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+
+import metrics
+
+# --- ENV CONFIG ---
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "16"))    # thread executor + pymongo pool
+MONGO_TIMEOUT = float(os.getenv("MONGO_TIMEOUT", "10"))      # detik per operasi
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "500"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "200"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))  # detik
+WRITE_QUEUE_LIMIT = int(os.getenv("WRITE_QUEUE_LIMIT", "10000"))
+WRITE_RETRY_MAX_DELAY = 30  # detik, batas backoff retry bulk insert
+MEMORY_AUTHKEY = os.getenv("MEMORY_AUTHKEY", "anon-memory").encode()
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_clients = {}
+op_counts = defaultdict(int)  # nama operasi -> jumlah panggilan, untuk benchmark dan metrik
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MONGO_POOL_SIZE, thread_name_prefix="mongo")
+    return _executor
+
+
+# --- ASYNC ADAPTER ---
+# Semua panggilan pymongo dijalankan di executor terbatas supaya event loop
+# (yang dipakai bersama oleh kedua bot) tidak pernah terblokir oleh round trip Mongo.
+async def _run(fn, *args, **kwargs):
+    op = fn.__name__
+    op_counts[op] += 1
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        call = loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(call, MONGO_TIMEOUT)
+    except Exception:
+        metrics.MONGO_ERRORS.inc((op,))
+        raise
+    finally:
+        metrics.MONGO_SECONDS.observe((op,), time.perf_counter() - started)
+
+
+class AsyncCursor:
+    def __init__(self, collection, args, kwargs):
+        self._collection = collection
+        self._args = args
+        self._kwargs = kwargs
+        self._sort = None
+        self._limit = 0
+        self._batch_size = MONGO_BATCH_SIZE
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        return self
+
+    def _open(self):
+        cursor = self._collection.find(*self._args, **self._kwargs)
+        if self._sort:
+            cursor = cursor.sort(self._sort)
+        if self._limit:
+            cursor = cursor.limit(self._limit)
+        return cursor
+
+    async def to_list(self, length=None):
+        def find():
+            cursor = self._open()
+            return list(itertools.islice(cursor, length) if length else cursor)
+        return await _run(find)
+
+    async def __aiter__(self):
+        def find():
+            return self._open()
+
+        def getmore():
+            return list(itertools.islice(cursor, self._batch_size))
+
+        cursor = await _run(find)
+        while True:
+            batch = await _run(getmore)
+            for doc in batch:
+                yield doc
+            if len(batch) < self._batch_size:
+                return
+
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self._collection, args, kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await _run(self._collection.find_one, *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return await _run(self._collection.find_one_and_update, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await _run(self._collection.insert_one, *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await _run(self._collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await _run(self._collection.update_one, *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await _run(self._collection.update_many, *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await _run(self._collection.delete_one, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await _run(self._collection.delete_many, *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return await _run(self._collection.count_documents, *args, **kwargs)
+
+    async def drop_index(self, *args, **kwargs):
+        return await _run(self._collection.drop_index, *args, **kwargs)
+
+    async def create_index(self, *args, **kwargs):
+        return await _run(self._collection.create_index, *args, **kwargs)
+
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = AsyncCollection(self._database[name])
+        return self._collections[name]
+
+
+# --- BULK WRITER ---
+# Menampung dokumen lalu menulisnya dengan insert_many saat batch penuh atau interval habis.
+# Antrian dibatasi WRITE_QUEUE_LIMIT: put() menunggu bila penuh (backpressure), dan stop()
+# selalu menulis sisa antrian sebelum selesai. Batch yang gagal dicoba ulang terus (backoff
+# dibatasi) dan tidak pernah dibuang: dokumennya sudah dikonfirmasi ke pengirim.
+_writers = []
+metrics.Gauge("mongo_write_queue", "Dokumen yang menunggu bulk insert atau update counter",
+              lambda: {(writer.collection.name,): writer.pending() for writer in _writers}, ("collection",))
+
+
+class BulkWriter:
+    _STOP = object()
+
+    def __init__(self, collection, batch_size=WRITE_BATCH_SIZE, interval=WRITE_FLUSH_INTERVAL,
+                 queue_limit=WRITE_QUEUE_LIMIT):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue_limit = queue_limit
+        self.written = 0
+        self.failures = 0
+        self._queue = None
+        self._task = None
+        _writers.append(self)
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(self.queue_limit)
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, document):
+        if self._task is None:
+            self.start()
+        await self._queue.put(document)
+
+    async def flush(self):
+        # Menunggu sampai semua dokumen yang sudah di-put sebelum panggilan ini tertulis
+        if self._task is None:
+            return
+        written = asyncio.get_running_loop().create_future()
+        await self._queue.put(written)
+        await written
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(self._STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is self._STOP:
+                break
+            if isinstance(item, asyncio.Future):
+                if not item.done():
+                    item.set_result(None)
+                continue
+            batch = [item]
+            waiter = None
+            deadline = loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                if isinstance(item, asyncio.Future):
+                    waiter = item
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    async def _flush(self, batch):
+        attempt = 0
+        while True:
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                return
+            except BulkWriteError as exc:
+                # Dokumen yang sudah masuk (termasuk duplicate key dari retry sebelumnya) tidak dikirim
+                # ulang. writeErrors lain adalah penolakan permanen per dokumen, retry tidak akan menolong.
+                errors = exc.details.get("writeErrors", [])
+                rejected = [error for error in errors if error.get("code") != 11000]
+                for error in rejected:
+                    logger.error("Dokumen %s ditolak Mongo: %s", self.collection.name, error.get("errmsg"))
+                if not exc.details.get("writeConcernErrors"):
+                    self.written += len(batch) - len(rejected)
+                    return
+                logger.warning("Bulk insert ke %s belum terkonfirmasi (percobaan %d)", self.collection.name, attempt + 1)
+            except Exception:
+                logger.exception("Bulk insert ke %s gagal (percobaan %d)", self.collection.name, attempt + 1)
+            self.failures += 1
+            await asyncio.sleep(min(WRITE_RETRY_MAX_DELAY, 2 ** min(attempt, 10)))
+            attempt += 1
+
+
+# --- COUNTER WRITER ---
+# Update counter ($inc, $set, $setOnInsert, $min, $max) digabung di memori per _id lalu ditulis
+# sebagai upsert setiap interval: dokumen statistik yang panas menerima satu update per interval,
+# bukan satu per pesan. on_insert(key, update) dipanggil bila upsert membuat dokumen baru.
+# Update yang gagal ditulis digabung kembali dan dicoba lagi di interval berikutnya.
+class CounterWriter:
+    def __init__(self, collection, interval=WRITE_FLUSH_INTERVAL, on_insert=None):
+        self.collection = collection
+        self.interval = interval
+        self.on_insert = on_insert
+        self._pending = {}  # _id -> update gabungan
+        self._stopping = None
+        self._task = None
+        _writers.append(self)
+
+    def pending(self):
+        return len(self._pending)
+
+    @staticmethod
+    def _merge(target, update):
+        for op, fields in update.items():
+            merged = target.setdefault(op, {})
+            for key, value in fields.items():
+                if op == "$inc":
+                    merged[key] = merged.get(key, 0) + value
+                elif op == "$setOnInsert":
+                    merged.setdefault(key, value)
+                elif op == "$min" and key in merged:
+                    merged[key] = min(merged[key], value)
+                elif op == "$max" and key in merged:
+                    merged[key] = max(merged[key], value)
+                else:
+                    merged[key] = value
+
+    def add(self, key, update):
+        if self._task is None:
+            self.start()
+        self._merge(self._pending.setdefault(key, {}), update)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        keys = list(batch)
+        results = await asyncio.gather(*(self.collection.update_one({"_id": key}, batch[key], upsert=True)
+                                         for key in keys), return_exceptions=True)
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                logger.warning("Update counter %s/%s gagal: %s", self.collection.name, key, result)
+                # Yang gagal lebih lama dari yang baru masuk, jadi jadi dasar penggabungan
+                failed = batch[key]
+                self._merge(failed, self._pending.get(key, {}))
+                self._pending[key] = failed
+            elif result.upserted_id is not None and self.on_insert is not None:
+                self.on_insert(key, batch[key])
+
+
+def get_database(uri, name):
+    if uri not in _clients:
+        if uri.startswith("memory://"):
+            address = uri[len("memory://"):]
+            _clients[uri] = SharedMemoryClient(address) if address else MemoryClient()
+        else:
+            timeout_ms = int(MONGO_TIMEOUT * 1000)
+            _clients[uri] = MongoClient(uri, maxPoolSize=MONGO_POOL_SIZE, serverSelectionTimeoutMS=timeout_ms,
+                                        connectTimeoutMS=timeout_ms, socketTimeoutMS=timeout_ms)
+    return AsyncDatabase(_clients[uri][name])
+
+
+# --- IN-MEMORY BACKEND ---
+# Pengganti lokal untuk MongoClient (MONGO_URI=memory://). Meniru subset API pymongo
+# sinkron yang dipakai bot, sehingga adapter async di atas tetap diuji apa adanya.
+_MISSING = object()
+
+
+def _sort_key(value):
+    return (0, 0) if value is None else (1, value)
+
+
+def _compare(value, op, arg):
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if value is _MISSING:
+        value = None
+    if op == "$eq":
+        return value == arg
+    if op == "$ne":
+        return value != arg
+    if op == "$in":
+        return value in arg
+    if op == "$nin":
+        return value not in arg
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > arg
+    if op == "$gte":
+        return value >= arg
+    if op == "$lt":
+        return value < arg
+    if op == "$lte":
+        return value <= arg
+    raise ValueError(f"Operator tidak didukung: {op}")
+
+
+
+def _matches(doc, query):
+    for key, cond in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = doc.get(key, _MISSING)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(_compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        elif isinstance(value, list) and not isinstance(cond, list):
+            if cond not in value:
+                return False
+        elif (None if value is _MISSING else value) != cond:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {key: 1 for key in projection}
+    include = {key for key, on in projection.items() if on and key != "_id"}
+    if include:
+        out = {key: copy.deepcopy(doc[key]) for key in include if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {key: copy.deepcopy(value) for key, value in doc.items() if projection.get(key, 1)}
+
+
+def _apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                doc[key] = copy.deepcopy(value)
+            elif op == "$unset":
+                doc.pop(key, None)
+            elif op == "$inc":
+                doc[key] = doc.get(key, 0) + value
+            elif op == "$max":
+                if key not in doc or doc[key] < value:
+                    doc[key] = value
+            elif op == "$min":
+                if key not in doc or doc[key] > value:
+                    doc[key] = value
+            elif op == "$push":
+                doc.setdefault(key, []).append(copy.deepcopy(value))
+            elif op == "$addToSet":
+                if value not in doc.setdefault(key, []):
+                    doc[key].append(copy.deepcopy(value))
+            elif op == "$pull":
+                doc[key] = [item for item in doc.get(key, []) if item != value]
+            elif op != "$setOnInsert":
+                raise ValueError(f"Operator update tidak didukung: {op}")
+
+
+class MemoryCursor:
+    # Sort/limit bekerja pada dokumen utuh; projection baru diterapkan saat iterasi (seperti Mongo)
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._iter = None
+
+    def sort(self, key_or_list, direction=None):
+        keys = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else list(key_or_list)
+        for key, order in reversed(keys):
+            self._docs.sort(key=lambda doc: _sort_key(doc.get(key)), reverse=order < 0)
+        return self
+
+    def limit(self, limit):
+        if limit:
+            self._docs = self._docs[:limit]
+        return self
+
+    def skip(self, skip):
+        self._docs = self._docs[skip:]
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iter is None:
+            self._iter = iter(self._docs)
+        doc = next(self._iter)
+        return _project(doc, self._projection) if self._projection else doc
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self._docs = {}
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def _select(self, query, sort=None):
+        if query and set(query) == {"_id"} and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            return [doc] if doc is not None else []
+        docs = [doc for doc in self._docs.values() if _matches(doc, query)]
+        if sort:
+            cursor = MemoryCursor(docs).sort(sort)
+            docs = cursor._docs
+        return docs
+
+    def find(self, filter=None, projection=None, **kwargs):
+        with self._lock:
+            return MemoryCursor([copy.deepcopy(doc) for doc in self._select(filter)], projection)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        with self._lock:
+            docs = self._select(filter, sort)
+            return _project(docs[0], projection) if docs else None
+
+    def count_documents(self, filter, **kwargs):
+        with self._lock:
+            return len(self._select(filter))
+
+    def insert_one(self, document, **kwargs):
+        with self._lock:
+            document.setdefault("_id", ObjectId())
+            if document["_id"] in self._docs:
+                raise ValueError(f"Duplicate key: {document['_id']}")
+            self._docs[document["_id"]] = copy.deepcopy(document)
+            return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        with self._lock:
+            ids = [self.insert_one(document).inserted_id for document in documents]
+            return InsertManyResult(ids, True)
+
+    def _upsert(self, filter, update):
+        doc = {key: copy.deepcopy(value) for key, value in filter.items()
+               if not key.startswith("$") and not isinstance(value, dict)}
+        _apply_update(doc, update, inserting=True)
+        doc.setdefault("_id", ObjectId())
+        self._docs[doc["_id"]] = doc
+        return doc
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            docs = self._select(filter)
+            if docs:
+                _apply_update(docs[0], update)
+                return UpdateResult({"n": 1, "nModified": 1}, True)
+            if upsert:
+                doc = self._upsert(filter, update)
+                return UpdateResult({"n": 0, "nModified": 0, "upserted": doc["_id"]}, True)
+            return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            docs = self._select(filter)
+            for doc in docs:
+                _apply_update(doc, update)
+            if not docs and upsert:
+                doc = self._upsert(filter, update)
+                return UpdateResult({"n": 0, "nModified": 0, "upserted": doc["_id"]}, True)
+            return UpdateResult({"n": len(docs), "nModified": len(docs)}, True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self._lock:
+            docs = self._select(filter, sort)
+            if docs:
+                before = copy.deepcopy(docs[0])
+                _apply_update(docs[0], update)
+                result = docs[0] if return_document == ReturnDocument.AFTER else before
+                return _project(result, projection)
+            if upsert:
+                doc = self._upsert(filter, update)
+                return _project(doc, projection) if return_document == ReturnDocument.AFTER else None
+            return None
+
+    def delete_one(self, filter, **kwargs):
+        with self._lock:
+            docs = self._select(filter)
+            if docs:
+                del self._docs[docs[0]["_id"]]
+            return DeleteResult({"n": len(docs[:1])}, True)
+
+    def delete_many(self, filter, **kwargs):
+        with self._lock:
+            docs = self._select(filter)
+            for doc in docs:
+                del self._docs[doc["_id"]]
+            return DeleteResult({"n": len(docs)}, True)
+
+    def drop_index(self, name, **kwargs):
+        with self._lock:
+            self._indexes.pop(name, None)
+
+    def create_index(self, keys, **kwargs):
+        with self._lock:
+            keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+            name = kwargs.get("name") or "_".join(f"{key}_{order}" for key, order in keys)
+            self._indexes[name] = (keys, kwargs)
+            return name
+
+
+class MemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+
+# --- SHARED IN-MEMORY BACKEND ---
+# memory://host:port: satu MemoryClient hidup di proses server (multiprocessing manager) dan
+# dipakai bersama oleh beberapa proses worker, pengganti lokal Mongo untuk mode multi-worker.
+_memory_server_client = None
+_memory_servers = []  # referensi manager; bila ter-GC server ikut mati
+
+
+def _memory_collection(database, name):
+    global _memory_server_client
+    if _memory_server_client is None:
+        _memory_server_client = MemoryClient()
+    return _memory_server_client[database][name]
+
+
+class MemoryManager(BaseManager):
+    pass
+
+
+MemoryManager.register("collection", callable=_memory_collection)
+
+
+def _parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def serve_memory(address):
+    # Menjalankan server di proses anak; panggil dari proses induk sebelum worker dibuat
+    manager = MemoryManager(address=_parse_address(address), authkey=MEMORY_AUTHKEY)
+    manager.start()
+    _memory_servers.append(manager)
+    return manager
+
+
+class SharedMemoryCollection:
+    # Proxy dibuat saat pertama dipakai, jadi modul bot boleh diimpor sebelum server jalan.
+    # Proxy manager membuka koneksi sendiri per thread, aman untuk executor Mongo.
+    def __init__(self, client, database, name):
+        self._client = client
+        self._database = database
+        self.name = name
+        self._proxy = None
+
+    def __getattr__(self, attr):
+        if self._proxy is None:
+            self._proxy = self._client.manager().collection(self._database, self.name)
+        return getattr(self._proxy, attr)
+
+
+class SharedMemoryDatabase:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+
+    def __getitem__(self, name):
+        return SharedMemoryCollection(self._client, self.name, name)
+
+
+class SharedMemoryClient:
+    def __init__(self, address):
+        self.address = _parse_address(address)
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def manager(self):
+        with self._lock:
+            if self._manager is None:
+                manager = MemoryManager(address=self.address, authkey=MEMORY_AUTHKEY)
+                manager.connect()
+                self._manager = manager
+            return self._manager
+
+    def __getitem__(self, name):
+        return SharedMemoryDatabase(self, name)
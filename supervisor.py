@@ -0,0 +1,276 @@
+# supervisor.py — menjalankan setiap bot di proses terpisah.
+#
+#   python supervisor.py              # anon + support
+#   python supervisor.py support      # hanya bot tertentu
+#
+# Bot anon yang sibuk tidak lagi berebut event loop dengan bot support, dan crash di satu bot
+# tidak mematikan yang lain. Proses yang keluar atau berhenti mengirim heartbeat di-restart
+# dengan backoff eksponensial. SIGTERM/SIGINT menghentikan semua bot dengan rapi (polling
+# berhenti, buffer pesan support ditulis). Status tiap proses ada di GET /health (SUPERVISOR_PORT).
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+from queue import Empty
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- ENV CONFIG ---
+USE_UVLOOP = os.getenv("USE_UVLOOP", "0") == "1"
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "60"))   # tanpa heartbeat selama ini = hang
+RESTART_BACKOFF = float(os.getenv("RESTART_BACKOFF", "1"))
+RESTART_BACKOFF_MAX = float(os.getenv("RESTART_BACKOFF_MAX", "60"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+SUPERVISOR_PORT = int(os.getenv("SUPERVISOR_PORT", "0"))          # 0 = tanpa endpoint /health (di METRICS_LISTEN)
+STABLE_AFTER = 60  # detik berjalan sebelum hitungan gagal di-reset
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("supervisor")
+
+
+# --- BOT PROCESS ---
+def new_event_loop():
+    if USE_UVLOOP:
+        try:
+            import uvloop
+            return uvloop.new_event_loop(), "uvloop"
+        except ImportError:
+            logger.warning("USE_UVLOOP=1 tetapi uvloop tidak terpasang, memakai asyncio")
+    return asyncio.new_event_loop(), "asyncio"
+
+
+def run_bot(name, index, heartbeats):
+    loop, loop_name = new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(serve_bot(name, index, heartbeats, loop_name))
+    finally:
+        loop.close()
+
+
+async def serve_bot(name, index, heartbeats, loop_name):
+    import metrics
+    from webhook import WebhookServer, WEBHOOK_URL, WEBHOOK_PORT, ANON_WORKER_PORT
+    if name == "anon":
+        from bot import start_anon_bot as start_bot, stop_anon_bot as stop_bot
+        port, metrics_port = ANON_WORKER_PORT, metrics.METRICS_PORT + 1
+    else:
+        from support import start_support_bot as start_bot, stop_support_bot as stop_bot
+        port, metrics_port = WEBHOOK_PORT, metrics.METRICS_PORT
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    app = None
+    state = {"status": "starting"}
+
+    def beat(lag=0.0):
+        handled = [(count, metrics.HANDLER_ERRORS.values.get(labels, 0))
+                   for labels, (_, _, count) in metrics.HANDLER_SECONDS.values.items() if labels[0] == name]
+        heartbeats.put({
+            "bot": name, "index": index, "pid": os.getpid(), "time": time.time(), "loop": loop_name,
+            "status": state["status"], "lag_ms": round(lag * 1000, 1),
+            "updates": sum(count for count, _ in handled), "errors": sum(errors for _, errors in handled),
+            "update_queue": app.update_queue.qsize() if app is not None else 0,
+        })
+
+    async def heartbeat():
+        # Lag = keterlambatan bangun dari sleep, tanda event loop sedang terblokir
+        while True:
+            started = loop.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            beat(loop.time() - started - HEARTBEAT_INTERVAL)
+
+    beat()
+    heartbeat_task = asyncio.create_task(heartbeat())
+    webhook = WebhookServer(port=port, register=index == 0) if WEBHOOK_URL else None
+    app = await start_bot(webhook)
+    if webhook is not None:
+        await webhook.start(reuse_port=True)
+    # /metrics di port internal terpisah; worker anon berbagi satu port lewat SO_REUSEPORT
+    server = WebhookServer(host=metrics.METRICS_LISTEN, port=metrics_port) if metrics.METRICS_PORT else None
+    if server is not None:
+        server.add_route("GET", "/metrics", metrics.handle_metrics)
+        await server.start(reuse_port=True)
+    state["status"] = "running"
+    beat()
+
+    await stopping.wait()
+    state["status"] = "stopping"
+    beat()
+    logger.info("%s-%d berhenti...", name, index)
+    for listener in (webhook, server):
+        if listener is not None:
+            await listener.stop()
+    await stop_bot(app)
+    heartbeat_task.cancel()
+    state["status"] = "stopped"
+    beat()
+
+
+# --- SUPERVISOR ---
+class Worker:
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+        self.process = None
+        self.started_at = 0.0
+        self.last_beat = 0.0
+        self.restart_at = 0.0
+        self.failures = 0
+        self.restarts = 0
+        self.health = {}
+
+    @property
+    def key(self):
+        return f"{self.name}-{self.index}"
+
+    def status(self, now):
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            **self.health,
+            "alive": alive,
+            "pid": self.process.pid if alive else None,
+            "uptime_s": round(now - self.started_at, 1) if alive else 0.0,
+            "heartbeat_age_s": round(now - self.last_beat, 1) if alive else None,
+            "restarts": self.restarts,
+            "failures": self.failures,
+        }
+
+
+class Supervisor:
+    def __init__(self, bots):
+        self.context = multiprocessing.get_context("spawn")
+        self.heartbeats = self.context.Queue()
+        self.workers = []
+        for name, count in bots:
+            self.workers.extend(Worker(name, index) for index in range(count))
+        self._by_key = {worker.key: worker for worker in self.workers}
+
+    def spawn(self, worker):
+        worker.process = self.context.Process(target=run_bot, args=(worker.name, worker.index, self.heartbeats),
+                                              name=worker.key)
+        worker.process.start()
+        worker.started_at = worker.last_beat = time.monotonic()
+        worker.health = {}
+        logger.info("%s dimulai (pid %d)", worker.key, worker.process.pid)
+
+    def _drain_heartbeats(self):
+        while True:
+            try:
+                beat = self.heartbeats.get_nowait()
+            except Empty:
+                return
+            worker = self._by_key.get(f"{beat['bot']}-{beat['index']}")
+            if worker is not None and worker.process is not None and worker.process.pid == beat["pid"]:
+                worker.health = beat
+                worker.last_beat = time.monotonic()
+
+    def check(self):
+        self._drain_heartbeats()
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self.spawn(worker)
+                continue
+            if worker.process.is_alive():
+                if now - worker.last_beat <= HEARTBEAT_TIMEOUT:
+                    continue
+                logger.error("%s tidak mengirim heartbeat %.0fs, dimatikan", worker.key, now - worker.last_beat)
+                worker.process.kill()
+                worker.process.join(5)
+
+            # Proses keluar: restart dengan backoff, hitungan gagal di-reset bila sempat stabil
+            if now - worker.started_at >= STABLE_AFTER:
+                worker.failures = 0
+            delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF * 2 ** worker.failures)
+            worker.failures += 1
+            worker.restarts += 1
+            worker.restart_at = now + delay
+            logger.error("%s keluar (kode %s), restart dalam %.1fs", worker.key, worker.process.exitcode, delay)
+            worker.process = None
+
+    def health(self):
+        now = time.monotonic()
+        return {worker.key: worker.status(now) for worker in self.workers}
+
+    def shutdown(self):
+        # SIGTERM ke semua bot (masing-masing flush lalu keluar), yang melewati batas waktu di-kill
+        running = [worker.process for worker in self.workers if worker.process is not None and worker.process.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.error("%s tidak berhenti dalam %.0fs, di-kill", process.name, SHUTDOWN_TIMEOUT)
+                process.kill()
+                process.join()
+
+
+def bot_counts(names):
+    from webhook import WEBHOOK_URL, ANON_WORKERS
+    anon_workers = ANON_WORKERS
+    if anon_workers > 1 and not (WEBHOOK_URL and os.getenv("MATCH_BACKEND") == "shared"):
+        logger.error("ANON_WORKERS=%d butuh WEBHOOK_URL dan MATCH_BACKEND=shared, pakai satu worker", anon_workers)
+        anon_workers = 1
+    return [(name, anon_workers if name == "anon" else 1) for name in names]
+
+
+async def main(names):
+    from webhook import WebhookServer
+    from storage import serve_memory
+    from metrics import METRICS_LISTEN
+
+    mongo_uri = os.getenv("MONGO_URI", "")
+    if mongo_uri.startswith("memory://") and mongo_uri != "memory://":
+        serve_memory(mongo_uri[len("memory://"):])
+
+    supervisor = Supervisor(bot_counts(names))
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    server = None
+    if SUPERVISOR_PORT:
+        async def handle_health(headers, body):
+            health = supervisor.health()
+            ok = all(status["alive"] and status.get("status") == "running" for status in health.values())
+            return 200 if ok else 503, "application/json", json.dumps(health).encode()
+
+        server = WebhookServer(host=METRICS_LISTEN, port=SUPERVISOR_PORT)
+        server.add_route("GET", "/health", handle_health)
+        await server.start()
+
+    last_report = time.monotonic()
+    while not stopping.is_set():
+        supervisor.check()
+        if time.monotonic() - last_report >= 60:
+            last_report = time.monotonic()
+            for key, status in supervisor.health().items():
+                logger.info("%s: %s", key, json.dumps(status))
+        try:
+            await asyncio.wait_for(stopping.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.info("Menghentikan semua bot...")
+    if server is not None:
+        await server.stop()
+    await loop.run_in_executor(None, supervisor.shutdown)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:] or ["anon", "support"]))
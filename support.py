@@ -1,4 +1,9 @@
 import os
+import html
+import gzip
+import json
+import time
+import asyncio
 import logging
 from dotenv import load_dotenv
 from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
@@ -6,8 +11,16 @@ from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
     CallbackContext, ContextTypes, filters, CallbackQueryHandler
 )
-from pymongo import MongoClient
-from datetime import datetime
+from telegram.error import Forbidden, TelegramError
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from storage import get_database, BulkWriter, CounterWriter
+from cache import LRUCache
+from ratelimit import SendScheduler, PRIORITY_BULK
+from dispatch import KeyedUpdateProcessor
+import metrics
+import profiler
 
 load_dotenv()
 
@@ -15,22 +28,56 @@ load_dotenv()
 BOT_TOKEN1 = os.getenv("BOT_TOKEN1")
 OWNER_ID = int(os.getenv("OWNER_ID"))
 MONGO_URI = os.getenv("MONGO_URI")
+INBOX_PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "10"))
+INBOX_PREVIEWS = (200, 100, 50, 20)  # panjang preview (setelah escape), diperpendek bila halaman terlalu panjang
+TELEGRAM_TEXT_LIMIT = 4096
+REPLY_INDEX_CACHE = int(os.getenv("REPLY_INDEX_CACHE", "20000"))
+REPLY_INDEX_TTL_DAYS = int(os.getenv("REPLY_INDEX_TTL_DAYS", "30"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))  # pengiriman paralel per gelombang
+BROADCAST_PROGRESS_INTERVAL = 15  # detik antar update pesan progres
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", "0"))  # 0 = simpan selamanya
+MESSAGE_RETENTION_MODE = os.getenv("MESSAGE_RETENTION_MODE", "ttl")     # ttl = dihapus Mongo, archive = dipindah ke file
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "archive")
+ARCHIVE_INTERVAL = 3600  # detik antar putaran arsip
+ARCHIVE_BATCH_SIZE = 1000
 
 # --- LOGGING ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- MONGO INIT ---
-client = MongoClient(MONGO_URI)
-db = client["support_bot"]
+db = get_database(MONGO_URI, "support_bot")
 messages = db["messages"]
+message_writer = BulkWriter(messages)
+# Reply-by-quote: message_id notifikasi di chat owner -> user_id pengirim
+reply_index = db["reply_index"]
+reply_writer = BulkWriter(reply_index)
+reply_cache = LRUCache(REPLY_INDEX_CACHE)
 temp_reply = {}  # user_id: replied_user_id
+broadcasts = db["broadcasts"]
+anon_users = get_database(MONGO_URI, "anon_chat")["users"]
+active_broadcast = {}  # "task": broadcast yang sedang jalan (maksimal satu), "stop": diminta berhenti
+archiver = {}  # "task" dan "stopping" untuk loop arsip pesan
+
+# Statistik yang dijaga saat pesan masuk, supaya /stats dan inbox tidak perlu menghitung messages
+STATS_TOTAL = "total"
+daily_stats = db["daily_stats"]  # _id "YYYY-MM-DD" per hari, plus _id "total"
+user_stats = db["user_stats"]    # _id user_id
+totals = {"unread": 0}  # salinan di proses dari counter total, untuk judul inbox tanpa query tambahan
+
+def count_new_user(user_id, update):
+    first = update["$setOnInsert"]["first"]
+    daily_counters.add(first.strftime("%Y-%m-%d"), {"$inc": {"new_users": 1}})
+    daily_counters.add(STATS_TOTAL, {"$inc": {"users": 1}})
+
+daily_counters = CounterWriter(daily_stats)
+user_counters = CounterWriter(user_stats, on_insert=count_new_user)
 
 # --- START COMMAND ---
 async def start(update: Update, context: CallbackContext):
     user = update.effective_user
     if user.id == OWNER_ID:
-        await update.message.reply_text("👑 Selamat datang Admin. Gunakan /inbox untuk melihat pesan.")
+        await update.message.reply_text("👑 Selamat datang Admin. Gunakan /inbox untuk melihat pesan.\nBalas (reply) notifikasi pesan untuk menjawab pengguna langsung.\nReply pesan dengan /broadcast untuk menyebarkannya ke semua pengguna.\n/stats untuk statistik pesan, /profile [detik] [update] untuk profil performa.")
     else:
         await update.message.reply_text(
             "🆘 *Bantuan Support*\n\nSilakan ketik atau kirim pesan ke admin. Kami akan membalas secepatnya.",
@@ -42,6 +89,13 @@ async def handle_message(update: Update, context: CallbackContext):
     user = update.effective_user
     message = update.message
 
+    # Owner membalas (quote) notifikasi: langsung ke pengirimnya, tanpa tombol Balas
+    if user.id == OWNER_ID and message.reply_to_message is not None:
+        target_id = await reply_target(message.reply_to_message.message_id)
+        if target_id is not None:
+            await forward_message_to_user(message, target_id, context)
+            return
+
     # Jika owner sedang membalas
     if user.id == OWNER_ID and user.id in temp_reply:
         target_id = temp_reply[user.id]
@@ -49,25 +103,195 @@ async def handle_message(update: Update, context: CallbackContext):
         del temp_reply[user.id]
         return
 
-    # Simpan pesan ke DB dan tampilkan ke admin
-    messages.insert_one({
+    # Simpan pesan ke DB (lewat bulk writer) dan tampilkan ke admin
+    doc = {
         "user_id": user.id,
         "username": user.username,
         "first_name": user.first_name,
         "text": message.text or None,
         "media": True if message.photo or message.video or message.voice or message.document or message.sticker else False,
-        "date": datetime.utcnow()
-    })
+        "read": False,
+        "date": utc_now_ms()
+    }
+    await message_writer.put(doc)
+    count_message(doc)
 
     if user.id != OWNER_ID:
-        await context.bot.send_message(
+        notification = await context.bot.send_message(
             OWNER_ID,
             f"✉️ Pesan baru dari [{user.first_name}](tg://user?id={user.id}):\n\n{text_preview(message)}",
             parse_mode="Markdown",
             reply_markup=reply_markup(user.id)
         )
+        await remember_reply_target(notification.message_id, user.id)
         await message.reply_text("✅ Pesan kamu telah dikirim ke admin. Mohon tunggu balasan ya!")
 
+# --- REPLY INDEX ---
+# LRU untuk notifikasi terbaru, koleksi reply_index (TTL) untuk yang lebih lama / setelah restart
+async def remember_reply_target(message_id, user_id):
+    reply_cache.put(message_id, user_id)
+    await reply_writer.put({"_id": message_id, "user_id": user_id, "date": datetime.utcnow()})
+
+async def reply_target(message_id):
+    user_id = reply_cache.get(message_id)
+    if user_id is None:
+        doc = await reply_index.find_one({"_id": message_id}, {"user_id": 1})
+        if doc is not None:
+            user_id = doc["user_id"]
+            reply_cache.put(message_id, user_id)
+    return user_id
+
+# --- STATS ---
+def count_message(doc):
+    media = int(bool(doc.get("media")))
+    unread = 1 if doc.get("read") is False else 0
+    daily_counters.add(doc["date"].strftime("%Y-%m-%d"), {"$inc": {"messages": 1, "media": media}})
+    daily_counters.add(STATS_TOTAL, {"$inc": {"messages": 1, "media": media, "unread": unread}})
+    totals["unread"] += unread
+    user_counters.add(doc["user_id"], {
+        "$inc": {"messages": 1, "unread": unread},
+        "$set": {"username": doc.get("username"), "first_name": doc.get("first_name"), "last": doc["date"]},
+        "$setOnInsert": {"first": doc["date"]},
+    })
+
+def count_read(user_id, count):
+    if count:
+        user_counters.add(user_id, {"$inc": {"unread": -count}})
+        daily_counters.add(STATS_TOTAL, {"$inc": {"unread": -count}})
+        totals["unread"] -= count
+
+async def flush_stats():
+    # Pengguna dulu: upsert pengguna baru menambah counter harian
+    await user_counters.flush()
+    await daily_counters.flush()
+
+async def rebuild_stats():
+    # Sekali saja untuk data yang sudah ada sebelum counter dipakai (satu scan urut tanggal)
+    total = await daily_stats.find_one({"_id": STATS_TOTAL}, {"unread": 1})
+    if total is not None:
+        totals["unread"] = total.get("unread", 0)
+        return
+    logger.info("Membangun statistik support dari koleksi messages...")
+    daily_counters.add(STATS_TOTAL, {"$inc": {"messages": 0, "media": 0, "unread": 0, "users": 0}})
+    projection = {"user_id": 1, "username": 1, "first_name": 1, "media": 1, "read": 1, "date": 1}
+    async for doc in messages.find({}, projection).sort([("date", 1), ("_id", 1)]):
+        count_message(doc)
+    await flush_stats()
+
+async def render_stats():
+    await flush_stats()
+    total = await daily_stats.find_one({"_id": STATS_TOTAL}) or {}
+    today = datetime.utcnow().date()
+    days = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(6, -1, -1)]
+    daily = {doc["_id"]: doc for doc in await daily_stats.find({"_id": {"$in": days}}).to_list()}
+    top = await user_stats.find({}, {"messages": 1, "first_name": 1}).sort("messages", -1).limit(5).to_list()
+
+    lines = [
+        "<b>📊 Statistik Support</b>",
+        f"💬 Total pesan: {total.get('messages', 0)} (media {total.get('media', 0)})",
+        f"🔵 Belum dibaca: {total.get('unread', 0)}",
+        f"👥 Pengguna: {total.get('users', 0)}",
+        "\n<b>7 hari terakhir</b> (pesan / pengguna baru)",
+    ]
+    for day in days:
+        doc = daily.get(day, {})
+        lines.append(f"{day}: {doc.get('messages', 0)} / {doc.get('new_users', 0)}")
+    if top:
+        lines.append("\n<b>Pengirim terbanyak</b>")
+        for doc in top:
+            name = html.escape(doc.get("first_name") or str(doc["_id"]))
+            lines.append(f"<a href=\"tg://user?id={doc['_id']}\">{name}</a>: {doc['messages']}")
+    return "\n".join(lines)
+
+async def stats(update: Update, context: CallbackContext):
+    if update.effective_user.id != OWNER_ID:
+        return
+    await update.message.reply_text(await render_stats(), parse_mode="HTML")
+
+# --- RETENTION ---
+# ttl: index TTL pada date, archive: loop berkala memindah pesan lama ke
+# MESSAGE_ARCHIVE_DIR/messages-YYYY-MM.jsonl.gz lalu menghapusnya dari koleksi.
+# Hanya pesan yang sudah dibaca yang kena retensi, jadi counter belum dibaca tetap tepat.
+# Statistik tidak berubah karena counter disimpan terpisah dari pesan mentah.
+def write_archive(docs):
+    os.makedirs(MESSAGE_ARCHIVE_DIR, exist_ok=True)
+    by_month = {}
+    for doc in docs:
+        by_month.setdefault(doc["date"].strftime("%Y-%m"), []).append(doc)
+    for month, month_docs in by_month.items():
+        # Mode append menambah member gzip baru; gzip/zcat membaca semuanya sebagai satu file
+        with gzip.open(os.path.join(MESSAGE_ARCHIVE_DIR, f"messages-{month}.jsonl.gz"), "at", encoding="utf-8") as f:
+            for doc in month_docs:
+                f.write(json.dumps({**doc, "_id": str(doc["_id"]), "date": doc["date"].isoformat()},
+                                   ensure_ascii=False, separators=(",", ":")) + "\n")
+
+async def archive_messages(stopping):
+    # Keyset di atas index (date, _id); crash di antara tulis dan hapus bisa menggandakan batch di arsip
+    cutoff = utc_now_ms() - timedelta(days=MESSAGE_RETENTION_DAYS)
+    query = {"date": {"$lt": cutoff}, "read": True}
+    archived = 0
+    while not stopping.is_set():
+        docs = await messages.find(query).sort([("date", 1), ("_id", 1)]).limit(ARCHIVE_BATCH_SIZE).to_list()
+        if not docs:
+            break
+        await asyncio.get_running_loop().run_in_executor(None, write_archive, docs)
+        await messages.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        archived += len(docs)
+        last = docs[-1]
+        query = {"date": {"$lt": cutoff}, "read": True,
+                 "$or": [{"date": {"$gt": last["date"]}}, {"date": last["date"], "_id": {"$gt": last["_id"]}}]}
+    if archived:
+        logger.info("%d pesan lama dipindah ke arsip %s", archived, MESSAGE_ARCHIVE_DIR)
+
+async def run_archiver(stopping):
+    while not stopping.is_set():
+        try:
+            await archive_messages(stopping)
+        except Exception:
+            logger.exception("Arsip pesan gagal")
+        try:
+            await asyncio.wait_for(stopping.wait(), ARCHIVE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def ensure_retention():
+    if MESSAGE_RETENTION_DAYS and MESSAGE_RETENTION_MODE == "ttl":
+        options = {"name": "retention_ttl", "expireAfterSeconds": MESSAGE_RETENTION_DAYS * 86400,
+                   "partialFilterExpression": {"read": True}}
+        try:
+            await messages.create_index("date", **options)
+        except OperationFailure:
+            # Jumlah hari berubah: index lama dengan opsi berbeda diganti
+            await messages.drop_index("retention_ttl")
+            await messages.create_index("date", **options)
+        return
+    try:
+        await messages.drop_index("retention_ttl")
+    except OperationFailure:
+        pass
+    if MESSAGE_RETENTION_DAYS and MESSAGE_RETENTION_MODE == "archive":
+        archiver["stopping"] = asyncio.Event()
+        archiver["task"] = asyncio.create_task(run_archiver(archiver["stopping"]))
+
+async def stop_archiver():
+    if "task" in archiver:
+        archiver["stopping"].set()
+        await archiver.pop("task")
+
+# --- TIME HELPERS ---
+# Mongo menyimpan tanggal dengan presisi milidetik; samakan dari awal supaya cursor inbox tepat
+EPOCH = datetime(1970, 1, 1)
+
+def utc_now_ms():
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def to_ms(date):
+    return (date - EPOCH) // timedelta(milliseconds=1)
+
+def from_ms(ms):
+    return EPOCH + timedelta(milliseconds=ms)
+
 # --- TEXT PREVIEW ---
 def text_preview(message):
     if message.text:
@@ -108,6 +332,12 @@ async def button_callback(update: Update, context: CallbackContext):
         temp_reply[update.effective_user.id] = uid
         await query.message.reply_text("✏️ Silakan ketik pesan balasan untuk pengguna.")
 
+    elif data.startswith("ib:"):
+        _, direction, filter_code, date_code, oid = data.split(":")
+        cursor = (from_ms(int(date_code, 36)), ObjectId(oid))
+        text, markup = await render_inbox(filter_code, direction, cursor)
+        await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+
 # --- FORWARD MEDIA TO USER ---
 async def forward_message_to_user(message, user_id, context):
     try:
@@ -123,34 +353,298 @@ async def forward_message_to_user(message, user_id, context):
             await context.bot.send_document(user_id, message.document.file_id)
         elif message.sticker:
             await context.bot.send_sticker(user_id, message.sticker.file_id)
+        # Pesan yang masih di buffer writer ikut ditandai dibaca
+        await message_writer.flush()
+        result = await messages.update_many({"user_id": user_id, "read": False}, {"$set": {"read": True}})
+        count_read(user_id, result.modified_count)
         await message.reply_text("✅ Balasan berhasil dikirim.")
         print(f"[OK] Balasan terkirim ke user {user_id}")
     except Exception as e:
         print(f"[ERROR] Gagal kirim ke {user_id} -> {e}")
         await message.reply_text("⚠️ Gagal mengirim balasan. Mungkin pengguna belum mulai bot atau telah memblokir bot.")
 
-# --- INBOX COMMAND ---
+# --- INBOX ---
+# Keyset pagination di atas index (date, _id). Cursor halaman disimpan di callback_data:
+#   ib:<o=lebih lama|n=lebih baru>:<filter>:<date ms base36>:<_id>
+# Filter: "a" semua, "r" belum dibaca, "u<user_id>" per pengguna.
+def inbox_query(filter_code):
+    if filter_code == "r":
+        return {"read": False}
+    if filter_code.startswith("u"):
+        return {"user_id": int(filter_code[1:])}
+    return {}
+
+def to_base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        number, rest = divmod(number, 36)
+        out = digits[rest] + out
+        if not number:
+            return out
+
+def inbox_cursor(direction, filter_code, msg):
+    return f"ib:{direction}:{filter_code}:{to_base36(to_ms(msg['date']))}:{msg['_id']}"
+
+async def load_inbox_page(filter_code, direction=None, cursor=None):
+    query = inbox_query(filter_code)
+    order = 1 if direction == "n" else -1
+    if cursor is not None:
+        date, oid = cursor
+        op = "$gt" if direction == "n" else "$lt"
+        query = {**query, "$or": [{"date": {op: date}}, {"date": date, "_id": {op: oid}}]}
+    docs = await messages.find(query).sort([("date", order), ("_id", order)]).limit(INBOX_PAGE_SIZE + 1).to_list()
+    more = len(docs) > INBOX_PAGE_SIZE
+    docs = docs[:INBOX_PAGE_SIZE]
+    if direction == "n":
+        docs.reverse()
+        return docs, more, True
+    return docs, cursor is not None, more
+
+def html_preview(text, limit):
+    # Dipotong setelah escape supaya panjang akhirnya pasti, tanpa memotong entity di tengah
+    escaped = html.escape(text)
+    if len(escaped) <= limit:
+        return escaped
+    cut = escaped[:limit]
+    amp = cut.rfind("&")
+    if amp != -1 and ";" not in cut[amp:]:
+        cut = cut[:amp]
+    return cut + "…"
+
+def inbox_entry(number, msg, limit):
+    preview = html_preview(msg["text"], limit) if msg.get("text") else "[Media]"
+    unread = "🔵 " if msg.get("read") is False else ""
+    name = html_preview(msg.get("first_name") or str(msg["user_id"]), 64)
+    return (
+        f"\n{number}. {unread}🕓 {msg['date'].strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"👤 <a href=\"tg://user?id={msg['user_id']}\">{name}</a>\n"
+        f"💬 {preview}"
+    )
+
+async def render_inbox(filter_code, direction=None, cursor=None):
+    docs, has_newer, has_older = await load_inbox_page(filter_code, direction, cursor)
+    title = {"a": "📥 Inbox", "r": "📥 Inbox (belum dibaca)"}.get(filter_code, f"📥 Inbox user {filter_code[1:]}")
+    if filter_code in ("a", "r"):
+        title += f" · 🔵 {totals['unread']}"
+    if not docs:
+        return "📭 Tidak ada pesan masuk.", None
+
+    for limit in INBOX_PREVIEWS:
+        text = "\n".join([f"<b>{title}</b>"] + [inbox_entry(number, msg, limit) for number, msg in enumerate(docs, 1)])
+        if len(text) <= TELEGRAM_TEXT_LIMIT:
+            break
+    reply_buttons = [InlineKeyboardButton(f"💬 {number}", callback_data=f"reply:{msg['user_id']}")
+                     for number, msg in enumerate(docs, 1)]
+
+    keyboard = [reply_buttons[i:i + 5] for i in range(0, len(reply_buttons), 5)]
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("◀", callback_data=inbox_cursor("n", filter_code, docs[0])))
+    if has_older:
+        nav.append(InlineKeyboardButton("▶", callback_data=inbox_cursor("o", filter_code, docs[-1])))
+    if nav:
+        keyboard.append(nav)
+    return text, InlineKeyboardMarkup(keyboard)
+
 async def inbox(update: Update, context: CallbackContext):
     if update.effective_user.id != OWNER_ID:
         return
-    cursor = messages.find().sort("date", -1).limit(10)
-    if await messages.count_documents({}) == 0:
-        await update.message.reply_text("📭 Tidak ada pesan masuk.")
+    # /inbox, /inbox unread, /inbox <user_id>
+    arg = context.args[0].lower() if context.args else ""
+    if arg == "unread":
+        filter_code = "r"
+    elif arg.isdigit():
+        filter_code = f"u{arg}"
+    else:
+        filter_code = "a"
+    text, markup = await render_inbox(filter_code)
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=markup)
+
+# --- BROADCAST ---
+# Penerima di-stream berurutan id dari dua sumber ber-index lalu di-merge tanpa duplikat, jadi
+# progres cukup disimpan sebagai id terakhir (checkpoint di koleksi broadcasts setiap gelombang).
+# Pesan yang di-reply owner disalin dengan copy_message pada prioritas bulk, di bawah rate limiter.
+async def anon_user_ids(after):
+    query = {"_id": {"$gt": after}} if after is not None else {}
+    async for user in anon_users.find(query, {"_id": 1}).sort("_id", 1):
+        yield user["_id"]
+
+async def support_user_ids(after):
+    # Lompat ke user_id berikutnya lewat index (user_id, date, _id): satu seek per pengguna,
+    # bukan memindai semua pesannya
+    while True:
+        query = {"user_id": {"$gt": after}} if after is not None else {}
+        docs = await messages.find(query, {"user_id": 1, "_id": 0}).sort("user_id", 1).limit(1).to_list()
+        if not docs:
+            return
+        after = docs[0]["user_id"]
+        yield after
+
+async def merge_unique(*sources):
+    heads = {}
+    for source in sources:
+        value = await anext(source, None)
+        if value is not None:
+            heads[source] = value
+    last = None
+    while heads:
+        source = min(heads, key=heads.get)
+        value = heads[source]
+        following = await anext(source, None)
+        if following is None:
+            del heads[source]
+        else:
+            heads[source] = following
+        if value != last:
+            last = value
+            yield value
+
+async def send_broadcast(bot, job, user_id):
+    try:
+        await bot.copy_message(user_id, job["from_chat_id"], job["message_id"], rate_limit_args=PRIORITY_BULK)
+        return "sent"
+    except Forbidden:
+        return "blocked"
+    except TelegramError as e:
+        logger.info("Broadcast ke %s gagal: %s", user_id, e)
+        return "failed"
+
+def broadcast_summary(job, elapsed, sent_now):
+    rate = sent_now / elapsed if elapsed else 0.0
+    return (f"📣 Broadcast {job['status']}\n"
+            f"✅ Terkirim: {job['sent']}\n⚠️ Gagal: {job['failed']}\n🚫 Memblokir bot: {job['blocked']}\n"
+            f"⚡ {rate:.1f} pesan/detik")
+
+async def run_broadcast(bot, job):
+    started = time.monotonic()
+    last_progress = started
+    done_now = 0
+    status = await bot.send_message(OWNER_ID, "📣 Broadcast dimulai...")
+    batch = []
+
+    async def flush():
+        nonlocal done_now
+        results = await asyncio.gather(*(send_broadcast(bot, job, user_id) for user_id in batch))
+        for result in results:
+            job[result] += 1
+        done_now += len(batch)
+        job["last_id"] = batch[-1]
+        await broadcasts.update_one({"_id": job["_id"]}, {"$set": {
+            "last_id": job["last_id"], "sent": job["sent"], "failed": job["failed"],
+            "blocked": job["blocked"], "updated": datetime.utcnow()}})
+        batch.clear()
+
+    try:
+        async for user_id in merge_unique(anon_user_ids(job["last_id"]), support_user_ids(job["last_id"])):
+            if user_id == OWNER_ID:
+                continue
+            batch.append(user_id)
+            if len(batch) >= BROADCAST_CONCURRENCY:
+                await flush()
+                if active_broadcast.get("stop"):
+                    job["status"] = "dijeda"
+                    break
+                if time.monotonic() - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    await bot.edit_message_text(broadcast_summary(job, last_progress - started, done_now),
+                                                chat_id=OWNER_ID, message_id=status.message_id)
+        else:
+            if batch:
+                await flush()
+            job["status"] = "selesai"
+        await broadcasts.update_one({"_id": job["_id"]}, {"$set": {"status": job["status"], "updated": datetime.utcnow()}})
+    except Exception:
+        # Status tetap "berjalan" sehingga bisa dilanjutkan dari checkpoint terakhir
+        logger.exception("Broadcast %s terhenti", job["_id"])
+        job["status"] = "terhenti"
+    finally:
+        active_broadcast.clear()
+    await bot.send_message(OWNER_ID, broadcast_summary(job, time.monotonic() - started, done_now))
+
+async def broadcast(update: Update, context: CallbackContext):
+    if update.effective_user.id != OWNER_ID:
+        return
+    # /broadcast (reply ke pesan yang akan disebar), /broadcast resume, /broadcast stop
+    arg = context.args[0].lower() if context.args else ""
+    running = active_broadcast.get("task")
+    if arg == "stop":
+        if running is None:
+            await update.message.reply_text("Tidak ada broadcast yang berjalan.")
+        else:
+            active_broadcast["stop"] = True
+            await update.message.reply_text("⏸ Broadcast akan dijeda setelah gelombang ini.")
+        return
+    if running is not None:
+        await update.message.reply_text("⏳ Broadcast lain masih berjalan. Gunakan /broadcast stop untuk menjeda.")
         return
-    for msg in cursor:
-        text = f"🕓 {msg['date'].strftime('%Y-%m-%d %H:%M:%S')}\n👤 [{msg['first_name']}](tg://user?id={msg['user_id']})\n"
-        text += f"💬 {msg['text'] if msg['text'] else '[Media]'}"
-        await update.message.reply_text(text, parse_mode="Markdown", reply_markup=reply_markup(msg['user_id']))
 
-async def start_support_bot():
-    app = ApplicationBuilder().token(BOT_TOKEN1).build()
+    if arg == "resume":
+        job = await broadcasts.find_one({"status": {"$in": ["berjalan", "dijeda"]}}, sort=[("created", -1)])
+        if job is None:
+            await update.message.reply_text("Tidak ada broadcast yang bisa dilanjutkan.")
+            return
+    elif update.message.reply_to_message is not None:
+        job = {"message_id": update.message.reply_to_message.message_id, "from_chat_id": update.effective_chat.id,
+               "last_id": None, "sent": 0, "failed": 0, "blocked": 0, "created": datetime.utcnow()}
+        job["_id"] = (await broadcasts.insert_one(job)).inserted_id
+    else:
+        await update.message.reply_text("Reply ke pesan yang ingin disebar dengan /broadcast.\n"
+                                        "/broadcast resume — lanjutkan yang terputus\n/broadcast stop — jeda")
+        return
+
+    job["status"] = "berjalan"
+    await broadcasts.update_one({"_id": job["_id"]}, {"$set": {"status": job["status"]}})
+    active_broadcast["stop"] = False
+    active_broadcast["task"] = asyncio.create_task(run_broadcast(context.bot, job))
+
+async def ensure_indexes():
+    await messages.create_index([("date", -1), ("_id", -1)])
+    await messages.create_index([("user_id", 1), ("date", -1), ("_id", -1)])
+    await messages.create_index([("date", -1), ("_id", -1)], name="unread_date",
+                                partialFilterExpression={"read": False})
+    await reply_index.create_index("date", expireAfterSeconds=REPLY_INDEX_TTL_DAYS * 86400)
+    await user_stats.create_index([("messages", -1)])
+
+async def start_support_bot(webhook=None):
+    # Konkuren antar user, berurutan per user (termasuk owner, yang memegang temp_reply)
+    app = (ApplicationBuilder().token(BOT_TOKEN1)
+           .rate_limiter(SendScheduler(name="support"))
+           .concurrent_updates(KeyedUpdateProcessor(name="support"))
+           .build())
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("inbox", inbox))
+    app.add_handler(CommandHandler("broadcast", broadcast))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("profile", profiler.profile_command))
     app.add_handler(CallbackQueryHandler(button_callback))
     app.add_handler(MessageHandler(filters.ALL, handle_message))
+    metrics.instrument_app(app, "support")
 
     print("🤖 Support Bot is running...")
+    await ensure_indexes()
+    await rebuild_stats()
+    await ensure_retention()
+    message_writer.start()
+    reply_writer.start()
+    daily_counters.start()
+    user_counters.start()
     await app.initialize()
     await app.start()
-    await app.updater.start_polling()
+    if webhook is None:
+        await app.updater.start_polling()
+    else:
+        await webhook.add_bot("support", app)
+    return app
+
+async def stop_support_bot(app):
+    if app.updater.running:
+        await app.updater.stop()
+    await app.stop()
+    await stop_archiver()
+    await message_writer.stop()
+    await reply_writer.stop()
+    await user_counters.stop()
+    await daily_counters.stop()
+    await app.shutdown()
@@ -0,0 +1,104 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# --- HASHED TIMING WHEEL ---
+# Timer disimpan di slot berdasarkan detik deadline-nya (modulo jumlah slot). Tiap tick hanya
+# slot yang jatuh tempo yang diperiksa, jadi biaya per tick tidak bergantung pada jumlah sesi.
+# Memundurkan deadline (touch) cukup mengubah angka di dict; entri dipindah ke slot baru secara
+# lazy saat slot lamanya diperiksa. Timer yang lebih jauh dari satu putaran ikut cara yang sama.
+class TimingWheel:
+    def __init__(self, tick=1.0, slots=1024):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._timers = {}  # key -> [deadline, slot]
+        self._current = int(time.monotonic() / tick)
+        self._task = None
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _slot(self, deadline):
+        # Tick yang sudah lewat tetap jatuh ke tick berikutnya supaya tidak terlewat satu putaran
+        return max(int(deadline / self.tick), self._current + 1) % len(self._slots)
+
+    def schedule(self, key, delay):
+        deadline = time.monotonic() + delay
+        timer = self._timers.get(key)
+        if timer is not None and deadline >= timer[0]:
+            timer[0] = deadline
+            return
+        if timer is not None:
+            self._slots[timer[1]].discard(key)
+        slot = self._slot(deadline)
+        self._timers[key] = [deadline, slot]
+        self._slots[slot].add(key)
+
+    def touch(self, key, delay):
+        # Hanya memundurkan timer yang sudah ada, O(1) tanpa memindah slot
+        timer = self._timers.get(key)
+        if timer is not None:
+            timer[0] = time.monotonic() + delay
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        self._slots[timer[1]].discard(key)
+        return True
+
+    def counts(self):
+        counts = {}
+        for key in self._timers:
+            counts[key[0]] = counts.get(key[0], 0) + 1
+        return counts
+
+    def advance(self, now=None):
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        expired = []
+        while self._current < target:
+            self._current += 1
+            index = self._current % len(self._slots)
+            due, self._slots[index] = self._slots[index], set()
+            for key in due:
+                timer = self._timers[key]
+                if timer[0] > now:
+                    timer[1] = self._slot(timer[0])
+                    self._slots[timer[1]].add(key)
+                else:
+                    del self._timers[key]
+                    expired.append(key)
+        self.expired += len(expired)
+        return expired
+
+    # --- BACKGROUND LOOP ---
+    def start(self, on_expire):
+        if self._task is None:
+            self._current = int(time.monotonic() / self.tick)
+            self._task = asyncio.create_task(self._run(on_expire))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, on_expire):
+        while True:
+            await asyncio.sleep(self.tick)
+            for key in self.advance():
+                try:
+                    await on_expire(key)
+                except Exception:
+                    logger.exception("Gagal memproses timer %s", key)
@@ -0,0 +1,130 @@
+import os
+import json
+import hmac
+import hashlib
+import asyncio
+import logging
+from http import HTTPStatus
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# --- ENV CONFIG ---
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                 # base URL publik, mis. https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")      # kosong: diturunkan dari token bot, lihat webhook_secret()
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") == "1"  # 0: jangan panggil setWebhook (tes offline)
+# Lebih dari satu worker anon hanya bisa dengan webhook + MATCH_BACKEND=shared. Worker berbagi
+# ANON_WORKER_PORT lewat SO_REUSEPORT; reverse proxy meneruskan <WEBHOOK_URL>/anon ke port itu.
+ANON_WORKERS = int(os.getenv("ANON_WORKERS", "1"))
+ANON_WORKER_PORT = int(os.getenv("ANON_WORKER_PORT", str(WEBHOOK_PORT + 1)))
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def webhook_secret(token, secret=WEBHOOK_SECRET):
+    # Validasi X-Telegram-Bot-Api-Secret-Token tidak pernah dimatikan. Tanpa WEBHOOK_SECRET, secret
+    # diturunkan dari token bot: sama di semua worker bot itu, dan tidak bisa ditebak tanpa token
+    if secret:
+        return secret
+    return hmac.new(token.encode(), b"webhook-secret", hashlib.sha256).hexdigest()
+
+
+# --- HTTP SERVER ---
+# Server HTTP/1.1 minimal di atas asyncio: cukup untuk menerima POST webhook dari
+# Telegram (keep-alive, Content-Length) dan beberapa endpoint GET internal.
+class WebhookServer:
+    def __init__(self, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET, register=WEBHOOK_REGISTER):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.register = register  # False untuk worker tambahan: setWebhook cukup sekali
+        self._routes = {}
+        self._server = None
+
+    def add_route(self, method, path, handler):
+        self._routes[(method, path)] = handler
+
+    async def add_bot(self, name, app):
+        path = f"/{name}"
+        secret = webhook_secret(app.bot.token, self.secret)
+
+        async def receive(headers, body):
+            token = headers.get("x-telegram-bot-api-secret-token", "")
+            if not hmac.compare_digest(token, secret):
+                return 403, "text/plain", b"forbidden"
+            try:
+                update = Update.de_json(json.loads(body), app.bot)
+            except ValueError:
+                return 400, "text/plain", b"bad update"
+            await app.update_queue.put(update)
+            return 200, "text/plain", b"ok"
+
+        self.add_route("POST", path, receive)
+        if self.register and WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + path, secret_token=secret,
+                allowed_updates=Update.ALL_TYPES
+            )
+        logger.info("Webhook %s terdaftar di %s", name, path)
+
+    async def start(self, reuse_port=False):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, reuse_port=reuse_port or None)
+        logger.info("Webhook server listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, "text/plain", b"too large", close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                handler = self._routes.get((method, target.split("?", 1)[0]))
+                if handler is None:
+                    status, content_type, payload = 404, "text/plain", b"not found"
+                else:
+                    try:
+                        status, content_type, payload = await handler(headers, body)
+                    except Exception:
+                        logger.exception("Webhook handler error pada %s", target)
+                        status, content_type, payload = 500, "text/plain", b"error"
+
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, content_type, payload, close=close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, payload, close=False):
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()